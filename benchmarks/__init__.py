@@ -0,0 +1,8 @@
+"""
+Performance benchmarks of the LVQ estimators and the fair GLVQ variants.
+
+``python -m benchmarks.run`` times fit and predict and measures their peak
+memory over a grid of data set sizes and model settings and writes the
+results as JSON. ``python -m benchmarks.compare`` compares two such files,
+e.g. of two commits, and reports the cases which got slower.
+"""
@@ -0,0 +1,81 @@
+"""
+Compare two result files of benchmarks.run, e.g. of two commits::
+
+    python -m benchmarks.compare old.json new.json --threshold 1.2
+
+Prints the ratio new / old of the fit and predict times and peak memory of
+every case present in both files and exits with status 1 if any ratio
+exceeds the threshold, or if a case failed in the new file or is missing
+in it.
+"""
+from __future__ import division, print_function
+
+import argparse
+import json
+import sys
+
+KEY = ('estimator', 'dataset', 'n_samples', 'n_features',
+       'prototypes_per_class', 'dim')
+MEASURES = ('fit_time', 'predict_time', 'fit_peak_memory',
+            'predict_peak_memory')
+
+
+def compare(old, new, threshold=1.2):
+    """Ratios new / old of the measurements of the cases in both reports.
+
+    Parameters
+    ----------
+    old, new : dict
+        Reports as written by benchmarks.run.
+    threshold : float, optional (default=1.2)
+        Ratio above which a measurement counts as a regression.
+
+    Returns
+    -------
+    rows : list of (key, measure, ratio, regression) tuples
+        Cases which raised in new have the measure 'error', cases of old
+        missing in new the measure 'missing', both with ratio None and
+        counted as regression.
+    """
+    before = {tuple(case[k] for k in KEY): case for case in old['results']}
+    after = set()
+    rows = []
+    for case in new['results']:
+        key = tuple(case[k] for k in KEY)
+        after.add(key)
+        if 'error' in case:
+            rows.append((key, 'error', None, True))
+            continue
+        if key not in before:
+            continue
+        for measure in MEASURES:
+            a, b = before[key].get(measure), case.get(measure)
+            if not a or b is None:
+                continue
+            rows.append((key, measure, b / a, b / a > threshold))
+    rows.extend((key, 'missing', None, True)
+                for key in before if key not in after)
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=1.2)
+    args = parser.parse_args(argv)
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    rows = compare(old, new, args.threshold)
+    for key, measure, ratio, regression in rows:
+        print('%-60s %-20s %6s%s' % (
+            ' '.join(str(k) for k in key), measure,
+            '-' if ratio is None else '%.2f' % ratio,
+            '  REGRESSION' if regression else ''))
+    return int(any(row[3] for row in rows))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
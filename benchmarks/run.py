@@ -0,0 +1,265 @@
+"""
+Time fit and predict of the LVQ estimators over a grid of settings.
+
+Every estimator is fitted with a fixed iteration budget on synthetic data of
+n_samples x n_features for each prototypes_per_class and (for the models
+with a projection) each dim of the grid. The results are written as JSON::
+
+    python -m benchmarks.run --n-samples 1000 10000 --n-features 2 10 \\
+        --output bench.json
+
+The bubbles data come from ``data.generator.DataGen``, the credit data
+from ``Data_Generata.CreditData`` and always have 5 features, so their grid
+ignores n_features.
+"""
+from __future__ import division, print_function
+
+import argparse
+import datetime
+import gc
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+
+import numpy as np
+import scipy
+import sklearn
+from sklearn.preprocessing import StandardScaler
+
+from sklearn_lvq import GlvqModel, GrlvqModel, GmlvqModel, GrmlvqModel, \
+    LgmlvqModel, RslvqModel, MrslvqModel, LmrslvqModel
+import abs_fair_glvq
+import normalized_fair_glvq
+import quad_fair_glvq
+
+ESTIMATORS = {
+    'GlvqModel': GlvqModel,
+    'GrlvqModel': GrlvqModel,
+    'GmlvqModel': GmlvqModel,
+    'GrmlvqModel': GrmlvqModel,
+    'LgmlvqModel': LgmlvqModel,
+    'RslvqModel': RslvqModel,
+    'MrslvqModel': MrslvqModel,
+    'LmrslvqModel': LmrslvqModel,
+    'MeanDiffGlvqModel': quad_fair_glvq.MeanDiffGlvqModel,
+    'AbsMeanDiffGlvqModel': abs_fair_glvq.MeanDiffGlvqModel,
+    'NormMeanDiffGlvqModel': normalized_fair_glvq.NormMeanDiffGlvqModel,
+}
+
+# estimators trained with fit_fair on the protected attribute
+FAIR_ESTIMATORS = ('MeanDiffGlvqModel', 'AbsMeanDiffGlvqModel',
+                   'NormMeanDiffGlvqModel')
+
+# number of features of the credit data, which make_data cannot change
+CREDIT_FEATURES = 5
+
+# estimators with a dim parameter for the rank of the relevance matrices
+PROJECTING_ESTIMATORS = ('GmlvqModel', 'GrmlvqModel', 'LgmlvqModel',
+                         'MrslvqModel', 'LmrslvqModel')
+
+# estimators with local relevance matrices, which take a list of dims
+LOCAL_ESTIMATORS = ('LgmlvqModel', 'LmrslvqModel')
+
+
+def make_data(dataset, n_samples, n_features, seed=0):
+    """Synthetic binary classification data with a protected attribute.
+
+    Parameters
+    ----------
+    dataset : {'bubbles', 'credit'}
+        'bubbles' draws two gaussian bubbles with n_features dimensions,
+        'credit' the credit approval data with CREDIT_FEATURES features,
+        which ignore n_features.
+    n_samples : int
+        Number of samples.
+    n_features : int
+        Number of features of the bubbles data.
+    seed : int, optional (default=0)
+        Seed of the generators.
+
+    Returns
+    -------
+    x : array, shape = [n_samples, n_features]
+        Standardized features.
+    y : array, shape = [n_samples]
+        Class labels.
+    protected : array, shape = [n_samples]
+        1 for samples of the protected group, 0 otherwise.
+    """
+    if dataset == 'bubbles':
+        from data.generator import DataGen
+        # DataGen draws from the global random state
+        np.random.seed(seed)
+        x, protected, y = DataGen().generate_two_bubbles_multi_dim(
+            n_samples, 0.3, 0.7, 0.3, 0.6, 0.8, np.full(n_features, 0.2))
+    elif dataset == 'credit':
+        from Data_Generata import CreditData
+        x, y = CreditData(5, 50000, 10, 20000, 7, 3).generate_credit_data(
+            n_samples, 0.5, 0.5, seed=seed)
+        x = np.asarray(x, dtype=np.float64)
+        protected = x[:, 0]
+    else:
+        raise ValueError("dataset must be one of 'bubbles', 'credit'")
+    x = StandardScaler().fit_transform(np.asarray(x, dtype=np.float64))
+    return x, np.asarray(y, dtype=int), np.asarray(protected, dtype=int)
+
+
+def _measure(call, repeat, memory):
+    """Best wall time of repeat calls and the peak of the memory allocated
+    during one extra traced call (None without memory)."""
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        call()
+        times.append(time.perf_counter() - start)
+    peak = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        call()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return min(times), peak
+
+
+def benchmark(name, x, y, protected, prototypes_per_class, dim, max_iter,
+              repeat=3, memory=True):
+    """Time fit and predict of one estimator on one data set.
+
+    Returns
+    -------
+    result : dict
+        fit_time and predict_time in seconds, fit_peak_memory and
+        predict_peak_memory in bytes, n_iter and the training accuracy.
+    """
+    params = {'prototypes_per_class': prototypes_per_class,
+              'max_iter': max_iter, 'random_state': 0}
+    if dim is not None:
+        params['dim'] = [dim] if name in LOCAL_ESTIMATORS else dim
+    if name in FAIR_ESTIMATORS:
+        params['alpha'] = 1
+    model = ESTIMATORS[name](**params)
+    if name in FAIR_ESTIMATORS:
+        def fit():
+            model.fit_fair(x, y, protected)
+    else:
+        def fit():
+            model.fit(x, y)
+    fit_time, fit_memory = _measure(fit, repeat, memory)
+    predict_time, predict_memory = _measure(lambda: model.predict(x),
+                                            repeat, memory)
+    return {'fit_time': fit_time, 'predict_time': predict_time,
+            'fit_peak_memory': fit_memory,
+            'predict_peak_memory': predict_memory,
+            'n_iter': int(model.n_iter_),
+            'score': float(np.mean(model.predict(x) == y))}
+
+
+def _grid(estimators, n_features, prototypes_per_class, dims):
+    for name in estimators:
+        for d in n_features:
+            for ppc in prototypes_per_class:
+                if name in PROJECTING_ESTIMATORS:
+                    ranks = [dim for dim in dims if dim is None or dim <= d]
+                else:
+                    ranks = [None]
+                for dim in ranks:
+                    yield name, d, ppc, dim
+
+
+def run(estimators=None, dataset='bubbles', n_samples=(1000,),
+        n_features=(2, 10), prototypes_per_class=(1, 3), dims=(None, 2),
+        max_iter=50, repeat=3, memory=True, verbose=False):
+    """Benchmark the estimators on every combination of the grid.
+
+    A case which raises is recorded with its error message instead of the
+    measurements, so one failing estimator does not abort the run.
+
+    Returns
+    -------
+    report : dict
+        'meta' describes the environment and the settings, 'results' holds
+        one dict per case.
+    """
+    if estimators is None:
+        estimators = list(ESTIMATORS)
+    if dataset == 'credit':
+        n_features = (CREDIT_FEATURES,)
+    results = []
+    for n in n_samples:
+        data = {}
+        for name, d, ppc, dim in _grid(estimators, n_features,
+                                       prototypes_per_class, dims):
+            if d not in data:
+                data[d] = make_data(dataset, n, d)
+            x, y, protected = data[d]
+            case = {'estimator': name, 'dataset': dataset,
+                    'n_samples': n, 'n_features': x.shape[1],
+                    'prototypes_per_class': ppc, 'dim': dim}
+            try:
+                case.update(benchmark(name, x, y, protected, ppc, dim,
+                                      max_iter, repeat, memory))
+            except Exception as e:
+                case['error'] = '%s: %s' % (type(e).__name__, e)
+            if verbose:
+                print(json.dumps(case))
+            results.append(case)
+    return {'meta': _meta(max_iter=max_iter, repeat=repeat),
+            'results': results}
+
+
+def _meta(**settings):
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    meta = {'commit': commit,
+            'date': datetime.datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'numpy': np.__version__, 'scipy': scipy.__version__,
+            'sklearn': sklearn.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor()}
+    meta.update(settings)
+    return meta
+
+
+def _dim(value):
+    return None if value == 'none' else int(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--estimators', nargs='+', choices=list(ESTIMATORS),
+                        default=list(ESTIMATORS))
+    parser.add_argument('--dataset', choices=['bubbles', 'credit'],
+                        default='bubbles')
+    parser.add_argument('--n-samples', nargs='+', type=int, default=[1000])
+    parser.add_argument('--n-features', nargs='+', type=int, default=[2, 10])
+    parser.add_argument('--prototypes-per-class', nargs='+', type=int,
+                        default=[1, 3])
+    parser.add_argument('--dim', nargs='+', type=_dim, default=[None, 2],
+                        help="ranks of the relevance matrices, 'none' for "
+                             "full rank")
+    parser.add_argument('--max-iter', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-memory', action='store_true',
+                        help='skip the traced runs for the peak memory')
+    parser.add_argument('--output', default='bench.json')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args(argv)
+    report = run(args.estimators, args.dataset, args.n_samples,
+                 args.n_features, args.prototypes_per_class, args.dim,
+                 args.max_iter, args.repeat, not args.no_memory,
+                 args.verbose)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,6 @@
 import math
 import numpy as np
 
-import matplotlib.pyplot as plt
 from sklearn_lvq.utils import _tango_color
 
 # from glvq.plot_2d import to_tango_colors
@@ -279,6 +278,7 @@ def prepare_plot(X, C, Y, Y_pred=None, prototypes=None, verbose=False, title="Pl
     log11 = np.logical_and(C, Y)
 
     # Plot the data and the prototypes as well
+    import matplotlib.pyplot as plt
     fig = plt.figure()
     fig.canvas.set_window_title(title)
     ax = fig.add_subplot(111)
@@ -379,6 +379,7 @@ def plot_prepared_dist(ax):
         ax: axes
             Axes object that holds the plotting information.
     """
+    import matplotlib.pyplot as plt
     ax.plot()
     plt.show()
     return
@@ -393,6 +394,7 @@ def plot_prepared_dist_multi(ax_list):
         ax: axes
             Axes object that holds the plotting information.
     """
+    import matplotlib.pyplot as plt
     for ax in ax_list:
         ax.plot()
     plt.show()
@@ -0,0 +1,615 @@
+# -*- coding: utf-8 -*-
+
+# License: BSD 3 clause
+
+"""GLVQ with a pluggable penalty on the unfairness of its outcome.
+
+The fairness terms compare the protected and the unprotected group by how
+close their samples are to the positive outcome. FairGlvqModel evaluates the
+distances, the winners and the sigmoid of the relative distances once per
+optimization step and hands them to a penalty of the PENALTIES registry,
+which returns its value and its derivative with respect to the relative
+distance of every sample in one pass.
+"""
+
+from __future__ import division
+
+import operator
+
+import numpy as np
+from sklearn.utils import validation
+
+from sklearn_lvq.activations import sigmoid, sigmoid_and_prime, \
+    sigmoid_prime
+from sklearn_lvq.glvq import GlvqModel, _prototype_gradient, \
+    _squared_euclidean, _winners
+
+
+def sgd(x, beta):
+    """Sigmoid 1 / (1 + exp(-beta * x)), see sklearn_lvq.activations."""
+    return sigmoid(x, beta)
+
+
+def dsgd(x, beta):
+    """Derivative of sgd with respect to x."""
+    return sigmoid_prime(x, beta)
+
+
+def group_partition(protected_labels, nb_samples):
+    """Order of the samples by group, computed once per fit.
+
+    Parameters
+    ----------
+    protected_labels : array-like, shape = [n_samples]
+        Nonzero for samples of the protected group.
+    nb_samples : int
+        Number of training samples.
+
+    Returns
+    -------
+    order : array, shape = [n_samples]
+        Stable permutation which puts the unprotected group first.
+    protected : array, shape = [n_samples]
+        1. for samples of the protected group, 0. otherwise, in this order.
+        Every contiguous slice and every sorted subset of it is again
+        ordered by group, see group_split.
+    """
+    protected = validation.column_or_1d(protected_labels) != 0
+    if protected.size != nb_samples:
+        raise ValueError("length of protected_labels does not fit the "
+                         "number of samples\n"
+                         "found=%d\n"
+                         "expected=%d" % (protected.size, nb_samples))
+    order = np.argsort(protected, kind='mergesort')
+    return order, protected[order].astype(np.float64)
+
+
+def group_split(protected):
+    """Number of unprotected samples, i.e. the start of the protected group,
+    in protected labels ordered by group."""
+    return np.searchsorted(protected, 1)
+
+
+def outcome_winners(dist, positive_prototypes=None):
+    """Closest prototypes of the negative and of the positive outcome.
+
+    The fairness terms compare the groups by how close their samples are to
+    the positive outcome, measured per sample with the relative distance
+    (d_neg - d_pos) / (d_neg + d_pos) to the closest prototype of the
+    negative and the closest prototype of the positive outcome. This holds
+    for any number of prototypes and classes.
+
+    Parameters
+    ----------
+    dist : array, shape = [n_samples, n_prototypes]
+        Squared distances of the samples to the prototypes.
+    positive_prototypes : array of bool, shape = [n_prototypes], optional
+        Prototypes of the positive outcome. Defaults to the second
+        prototype, the positive class of a binary model with one prototype
+        per class.
+
+    Returns
+    -------
+    relative_dist : array, shape = [n_samples]
+    d_neg, d_pos : array, shape = [n_samples]
+        Distances to the closest prototypes of either outcome.
+    pidx_neg, pidx_pos : array, shape = [n_samples]
+        Indices of these prototypes.
+    """
+    if positive_prototypes is None:
+        positive_prototypes = np.arange(dist.shape[1]) == 1
+    _, d_pos, d_neg, pidx_pos, pidx_neg = _winners(dist, positive_prototypes)
+    return (d_neg - d_pos) / (d_neg + d_pos), d_neg, d_pos, pidx_neg, pidx_pos
+
+
+def relative_distance(dist, positive_prototypes=None):
+    """Relative distance of every sample to the closest prototypes of the
+    negative and the positive outcome, the argument of the sigmoid in the
+    fairness terms, see outcome_winners."""
+    return outcome_winners(dist, positive_prototypes)[0]
+
+
+def fairness_gradient(training_data, prototypes, outcome, weights):
+    """Gradient of ``sum(weights * relative_dist)`` with respect to all
+    prototypes.
+
+    outcome is the result of outcome_winners. Only the two closest
+    prototypes of each sample receive a share, so the cost is linear in the
+    number of samples and prototypes.
+
+    Returns
+    -------
+    gradient : array, shape = [n_prototypes, n_features]
+    """
+    _, d_neg, d_pos, pidx_neg, pidx_pos = outcome
+    weights = 4 * weights / (d_neg + d_pos) ** 2
+    return _prototype_gradient(training_data, prototypes, pidx_pos, pidx_neg,
+                               -weights * d_pos, -weights * d_neg)
+
+
+def _mean_difference(phi, protected, nr_protected):
+    sum_protected = protected.dot(phi)
+    return sum_protected / nr_protected - (phi.sum() - sum_protected) / (
+        protected.size - nr_protected)
+
+
+def _mean_difference_prime(protected, nr_protected):
+    """Derivative of _mean_difference with respect to the phi of every
+    sample."""
+    group = protected != 0
+    return np.where(group, 1., -1.) / np.where(
+        group, nr_protected, protected.size - nr_protected)
+
+
+def mean_difference(protected_labels, nr_protected_group, dist, beta,
+                    relative_dist=None):
+    """Difference of the mean sigmoid outputs of the protected and the
+    unprotected group.
+
+    relative_dist, the result of relative_distance(dist), is computed from
+    dist with the default positive prototypes if not given.
+    """
+    if relative_dist is None:
+        relative_dist = relative_distance(dist)
+    protected = np.asarray(protected_labels, dtype=relative_dist.dtype)
+    return _mean_difference(sigmoid(relative_dist, beta), protected,
+                            nr_protected_group)
+
+
+def minimum_norm(sum_phi, m, nr_protected):
+    values = [(sum_phi / m) / (1 - nr_protected / m), (1 - sum_phi / m) / (nr_protected / m)]
+
+    if values[0] == values[1]:
+        min_index = 2
+        min_value = values[0]
+    else:
+        min_index, min_value = min(enumerate(values), key=operator.itemgetter(1))
+    return min_index, min_value
+
+
+def _group_sums(protected_labels, phi):
+    """Sums of phi over the unprotected and over the protected group."""
+    phi_protected_group = np.asarray(protected_labels, dtype=phi.dtype).dot(phi)
+    return phi.sum() - phi_protected_group, phi_protected_group
+
+
+def fairness_phi(protected_labels, dist, beta):
+    return _group_sums(protected_labels, sigmoid(relative_distance(dist), beta))
+
+
+def _normalized_difference(protected_labels, nr_protected, phi):
+    m = phi.size
+    sgd_unprotected, sgd_protected = _group_sums(protected_labels, phi)
+    min_index, min_value = minimum_norm(sgd_protected + sgd_unprotected, m, nr_protected)
+    mean_diff = sgd_unprotected / (m - nr_protected) - sgd_protected / nr_protected
+    return mean_diff / min_value, mean_diff, min_index, min_value
+
+
+def normalized_mean_difference(protected_labels, nr_protected, dist, beta,
+                               phi=None):
+    """Difference of the mean sigmoid outputs of the unprotected and the
+    protected group, normalized by minimum_norm.
+
+    phi, the sigmoid of the relative distances, is computed from dist if not
+    given.
+    """
+    if phi is None:
+        phi = sigmoid(relative_distance(dist), beta)
+    return _normalized_difference(protected_labels, nr_protected, phi)[0]
+
+
+def quadratic_penalty(phi, phi_prime, protected, nr_protected):
+    """Squared mean difference of the groups.
+
+    Parameters
+    ----------
+    phi, phi_prime : array, shape = [n_samples]
+        Sigmoid of the relative distances of the samples, see
+        outcome_winners, and its derivative.
+    protected : array, shape = [n_samples]
+        1. for samples of the protected group, 0. otherwise, ordered by
+        group as group_partition returns them.
+    nr_protected : int
+        Number of samples of the protected group.
+
+    Returns
+    -------
+    value : float
+        Penalty.
+    weights : array, shape = [n_samples]
+        Derivative of the penalty with respect to the relative distance of
+        every sample.
+    """
+    diff = _mean_difference(phi, protected, nr_protected)
+    return diff ** 2, 2 * diff * _mean_difference_prime(
+        protected, nr_protected) * phi_prime
+
+
+def abs_penalty(phi, phi_prime, protected, nr_protected):
+    """Absolute mean difference of the groups if the protected group is
+    ahead by more than 0.001, the squared one otherwise. See
+    quadratic_penalty for the parameters."""
+    diff = _mean_difference(phi, protected, nr_protected)
+    if diff > 0.001:
+        return abs(diff), np.sign(diff) * _mean_difference_prime(
+            protected, nr_protected) * phi_prime
+    return diff ** 2, 2 * diff * _mean_difference_prime(
+        protected, nr_protected) * phi_prime
+
+
+def normalized_penalty(phi, phi_prime, protected, nr_protected):
+    """Squared normalized mean difference of the groups, see
+    normalized_mean_difference and quadratic_penalty for the parameters."""
+    norm_mean_difference, mean_diff, min_index, min_value = \
+        _normalized_difference(protected, nr_protected, phi)
+    m = phi.size
+    # derivatives of the mean difference and of minimum_norm with respect
+    # to the phi of the samples
+    dmean_diff = -_mean_difference_prime(protected, nr_protected)
+    dmin = [1 / (m - nr_protected), -1 / nr_protected]
+    if min_index == 2:
+        dmin = 0.5 * (dmin[0] + dmin[1])
+    else:
+        dmin = dmin[min_index]
+    dnorm = (dmean_diff * min_value - mean_diff * dmin) / min_value ** 2
+    return norm_mean_difference ** 2, \
+        2 * norm_mean_difference * dnorm * phi_prime
+
+
+PENALTIES = {'quadratic': quadratic_penalty,
+             'abs': abs_penalty,
+             'normalized': normalized_penalty}
+
+
+def _penalty_function(penalty):
+    if callable(penalty):
+        return penalty
+    if penalty not in PENALTIES:
+        raise ValueError("penalty must be one of %s or a callable" % ', '.join(
+            repr(name) for name in sorted(PENALTIES)))
+    return PENALTIES[penalty]
+
+
+class FairGlvqModel(GlvqModel):
+    """Generalized Learning Vector Quantization with a fairness penalty
+
+    Minimizes the mean GLVQ cost plus alpha times a penalty on the
+    difference of the protected and the unprotected group in how close
+    their samples are to the prototypes of the positive outcome, the last
+    class. Train it with fit_fair or partial_fit, which take the group of
+    every sample.
+
+    Parameters
+    ----------
+
+    penalty : str or callable, optional (default='quadratic')
+        Fairness penalty, a key of PENALTIES: 'quadratic' for the squared
+        mean difference, 'abs' for the absolute mean difference (squared
+        below 0.001) and 'normalized' for the squared normalized mean
+        difference. A callable is called as
+        ``penalty(phi, phi_prime, protected, nr_protected)`` and returns
+        the value and the derivative with respect to the relative distance
+        of every sample, see quadratic_penalty.
+
+    alpha : float, optional (default=0)
+        Weight of the fairness penalty. alpha = 0 means normal glvq.
+
+    prototypes_per_class : int or list of int, optional (default=1)
+        Number of prototypes per class. Use list to specify different
+        numbers per class.
+
+    initial_prototypes : array-like, shape =  [n_prototypes, n_features + 1],
+     optional
+        Prototypes to start with. If not given initialization near the class
+        means. Class label must be placed as last entry of each prototype.
+
+    max_iter : int, optional (default=2500)
+        The maximum number of iterations. For the stochastic solvers the
+        number of epochs.
+
+    gtol : float, optional (default=1e-5)
+        Gradient norm must be less than gtol before successful termination
+        of bfgs.
+
+    beta : int, optional (default=2)
+        Used inside phi.
+        1 / (1 + np.math.exp(-beta * x))
+
+    C : array-like, shape = [2,3] ,optional
+        Weights for wrong classification of form (y_real,y_pred,weight)
+        Per default all weights are one, meaning you only need to specify
+        the weights not equal one.
+
+    display : boolean, optional (default=False)
+        Print information about the bfgs steps.
+
+    random_state : int, RandomState instance or None, optional
+        If int, random_state is the seed used by the random number generator;
+        If RandomState instance, random_state is the random number generator;
+        If None, the random number generator is the RandomState instance used
+        by `np.random`.
+
+    solver : {'l-bfgs-b', 'sgd', 'adam'}, optional (default='l-bfgs-b')
+        Optimizer. 'l-bfgs-b' minimizes the cost on the whole training set,
+        'sgd' and 'adam' run mini-batch gradient descent for max_iter epochs.
+
+    batch_size : int, optional (default=256)
+        Size of the mini-batches of the stochastic solvers.
+
+    learning_rate : {'constant', 'invscaling'}, optional (default='constant')
+        Step size schedule of the stochastic solvers. 'invscaling' divides
+        learning_rate_init by the square root of the epoch number.
+
+    learning_rate_init : float, optional (default=0.01)
+        Initial step size of the stochastic solvers.
+
+    chunk_size : int or None, optional (default=None)
+        Number of samples for which the distances in predict and
+        decision_function are evaluated at once. None means blocks of at
+        most 4096 samples. fit_fair always evaluates cost and gradient on all
+        samples,
+        because the penalty depends on the means over the groups.
+
+    dtype : {np.float32, np.float64}, optional (default=np.float64)
+        Floating point type of the data, the prototypes and all intermediate
+        distances. np.float32 halves the memory traffic of the distance
+        computations at the cost of precision.
+
+    n_jobs : int or None, optional (default=None)
+        Number of threads predict and decision_function use to process the
+        blocks of samples in parallel, and number of processes for the
+        n_init fits. None means 1, -1 means all processors.
+
+    n_init : int, optional (default=1)
+        Number of fit_fair runs from different random initializations. The
+        model with the lowest final cost is kept.
+
+    Attributes
+    ----------
+
+    w_ : array-like, shape = [n_prototypes, n_features]
+        Prototype vector, where n_prototypes in the number of prototypes and
+        n_features is the number of features
+
+    c_w_ : array-like, shape = [n_prototypes]
+        Prototype classes
+
+    classes_ : array-like, shape = [n_classes]
+        Array containing labels.
+
+    See also
+    --------
+    GlvqModel
+    """
+
+    def __init__(self, penalty='quadratic', alpha=0, prototypes_per_class=1,
+                 initial_prototypes=None, max_iter=2500, gtol=1e-5, beta=2,
+                 C=None, display=False, random_state=None,
+                 solver='l-bfgs-b', batch_size=256, learning_rate='constant',
+                 learning_rate_init=0.01, chunk_size=None, dtype=np.float64,
+                 n_jobs=None, n_init=1):
+        super(FairGlvqModel, self).__init__(
+            prototypes_per_class=prototypes_per_class,
+            initial_prototypes=initial_prototypes, max_iter=max_iter,
+            gtol=gtol, beta=beta, C=C, display=display,
+            random_state=random_state, solver=solver, batch_size=batch_size,
+            learning_rate=learning_rate,
+            learning_rate_init=learning_rate_init, chunk_size=chunk_size,
+            dtype=dtype, n_jobs=n_jobs, n_init=n_init)
+        self.penalty = penalty
+        self.alpha = alpha
+
+    def _fair_terms(self, training_data, prototypes, label_equals_prototype,
+                    protected_labels, nr_protected_group, penalty):
+        """Winners of _winners, the outcome_winners of the fairness term and
+        the value and sample weights of the penalty, shared by _optfun and
+        _optgrad. The last class is the positive outcome.
+
+        The penalty compares the means of the two groups, so it is left out
+        (None, 0, None) for alpha = 0 and for mini-batches which hold only
+        one group; the samples are ordered by group, so these start and end
+        with the same label.
+        """
+        dist = _squared_euclidean(training_data, prototypes)
+        winners = _winners(dist, label_equals_prototype)
+        if self.alpha == 0 or protected_labels[0] == protected_labels[-1]:
+            return winners + (None, 0, None)
+        outcome = outcome_winners(dist, self.c_w_ == self.classes_[-1])
+        phi, phi_prime = sigmoid_and_prime(outcome[0], self.beta)
+        return winners + (outcome,) + tuple(
+            penalty(phi, phi_prime, protected_labels, nr_protected_group))
+
+    def _optgrad(self, variables, training_data, label_equals_prototype,
+                 random_state, protected_labels, nr_protected_group, penalty):
+        n_data, n_dim = training_data.shape
+        nb_prototypes = self.c_w_.size
+        prototypes = variables.reshape(nb_prototypes, n_dim)
+
+        _, distcorrect, distwrong, pidxcorrect, pidxwrong, outcome, _, \
+            weights = self._cached(
+                variables, training_data,
+                lambda: self._fair_terms(training_data, prototypes,
+                                         label_equals_prototype,
+                                         protected_labels, nr_protected_group,
+                                         penalty))
+
+        distcorrectpluswrong = distcorrect + distwrong
+        distcorectminuswrong = distcorrect - distwrong
+        mu = distcorectminuswrong / distcorrectpluswrong
+        mu = self.phi_prime(mu)
+
+        distcorrectpluswrong = 4 / distcorrectpluswrong ** 2
+
+        dcd = mu * distcorrect * distcorrectpluswrong
+        dwd = mu * distwrong * distcorrectpluswrong
+        g = 1 / n_data * _prototype_gradient(training_data, prototypes,
+                                             pidxcorrect, pidxwrong, dcd, dwd)
+        # the cost is the mean glvq cost plus alpha times the penalty, which
+        # already is a function of group means
+        if weights is not None:
+            g += self.alpha * fairness_gradient(training_data, prototypes,
+                                                outcome, weights)
+        g = g * (1 + 0.0001 * random_state.rand(*g.shape) - 0.5)
+        return g.ravel()
+
+    def _optfun(self, variables, training_data, label_equals_prototype,
+                protected_labels, nr_protected_group, penalty):
+        n_data, n_dim = training_data.shape
+        nb_prototypes = self.c_w_.size
+        prototypes = variables.reshape(nb_prototypes, n_dim)
+
+        _, distcorrect, distwrong, _, pidxwrong, _, value, _ = self._cached(
+            variables, training_data,
+            lambda: self._fair_terms(training_data, prototypes,
+                                     label_equals_prototype,
+                                     protected_labels, nr_protected_group,
+                                     penalty))
+
+        distcorrectpluswrong = distcorrect + distwrong
+        distcorectminuswrong = distcorrect - distwrong
+        mu = distcorectminuswrong / distcorrectpluswrong
+        mu *= self.c_[label_equals_prototype.argmax(1), pidxwrong]  # y_real, y_pred
+
+        mu_sum = self.phi(mu).sum(0)
+
+        if self.alpha == 0:
+            return mu_sum
+
+        return mu_sum / n_data + self.alpha * value
+
+    def _validate_train_parms(self, train_set, train_lab, classes=None):
+        _penalty_function(self.penalty)
+        return super(FairGlvqModel, self)._validate_train_parms(
+            train_set, train_lab, classes)
+
+    def _accumulate(self, fun, jac, variables, data):
+        # the penalty is no sum over the samples, so cost and gradient are
+        # evaluated on all of them at once regardless of chunk_size
+        data = self._shifted(list(data))
+        if jac is None:
+            return fun(variables, *data)
+        return fun(variables, *data), jac(variables, *data)
+
+    def _count_groups(self, protected_labels, accumulate=False):
+        """Keep the numbers of unprotected and protected samples of the
+        training data, summed over the partial_fit calls with accumulate."""
+        split = group_split(protected_labels)
+        counts = np.array([split, protected_labels.size - split])
+        if accumulate:
+            counts += self._group_counts
+        self._group_counts = counts
+
+    def _nr_protected(self, protected_labels):
+        """Number of protected samples expected among protected_labels, by
+        the share of the protected group in all training data. Mini-batches
+        estimate the group means with it instead of with their own, noisy
+        group sizes."""
+        nb_unprotected, nb_protected = self._group_counts
+        return protected_labels.size * nb_protected / (
+            nb_unprotected + nb_protected)
+
+    def _optimize(self, x, y, protected_labels, random_state):
+        """Fit the prototypes; the samples are ordered by group and
+        protected_labels is the second result of group_partition."""
+        label_equals_prototype = y[np.newaxis].T == self.c_w_
+        penalty = _penalty_function(self.penalty)
+        res = self._minimize(
+            fun=lambda vs, x, lep, pl: self._optfun(
+                variables=vs, training_data=x,
+                label_equals_prototype=lep, protected_labels=pl,
+                nr_protected_group=self._nr_protected(pl),
+                penalty=penalty),
+            jac=lambda vs, x, lep, pl: self._optgrad(
+                variables=vs, training_data=x,
+                label_equals_prototype=lep,
+                random_state=random_state, protected_labels=pl,
+                nr_protected_group=self._nr_protected(pl),
+                penalty=penalty),
+            x0=self.w_, data=(x, label_equals_prototype, protected_labels),
+            random_state=random_state)
+        self.w_ = res.x.reshape(self.w_.shape)
+        self.n_iter_ = res.nit
+
+    def split_x(self, x, dim_protected):
+
+        protected = []
+        new_x = []
+
+        for i in range(0, len(x)):
+            protected.append(x[i][dim_protected])
+            new_x.append(
+                x[i][:dim_protected] + x[i][dim_protected + 1:]
+            )
+
+        return new_x, protected
+
+    def fit(self, x, y):
+        """Not available, the penalty needs the group of every sample. Use
+        fit_fair(x, y, protected_labels) instead."""
+        raise ValueError(type(self).__name__ + " needs the protected group "
+                         "of every sample, use fit_fair(x, y, "
+                         "protected_labels) instead of fit(x, y)")
+
+    def fit_fair(self, x, y, protected_labels):
+        """Fit the GLVQ model to the given training data and parameters using
+        l-bfgs-b.
+
+        Parameters
+        ----------
+        x : array-like, shape = [n_samples, n_features]
+          Training vector, where n_samples in the number of samples and
+          n_features is the number of features.
+        y : array, shape = [n_samples]
+          Target values (integers in classification, real numbers in
+          regression)
+        protected_labels : array-like, shape = [n_samples]
+          1 for samples of the protected group, 0 otherwise
+
+        Returns
+        --------
+        self
+        """
+        self._partial = None
+        if isinstance(self.n_init, int) and self.n_init > 1:
+            return self._fit_n_init('fit_fair', x, y, protected_labels)
+        x, y, random_state = self._validate_train_parms(x, y)
+        if len(np.unique(y)) == 1:
+            raise ValueError("fitting " + type(
+                self).__name__ + " with only one class is not possible")
+
+        order, protected = group_partition(protected_labels, y.size)
+        self._count_groups(protected)
+        self._optimize_centered(x[order], y[order], protected, random_state)
+        self._cache = None
+        return self
+
+    def partial_fit(self, x, y, protected_labels, classes=None):
+        """Update the GLVQ model with one epoch of stochastic gradient descent
+        over the given batch. The first call initializes the model like
+        fit_fair and fixes the set of classes. The penalty weighs the groups
+        by their sizes summed over all calls.
+
+        Parameters
+        ----------
+        x : array-like, shape = [n_samples, n_features]
+          Training vector, where n_samples in the number of samples and
+          n_features is the number of features.
+        y : array, shape = [n_samples]
+          Target values (integers in classification, real numbers in
+          regression)
+        protected_labels : array, shape = [n_samples]
+          1 for samples of the protected group, 0 otherwise
+        classes : array, shape = [n_classes], optional
+          All classes of the stream, see GlvqModel.partial_fit.
+
+        Returns
+        --------
+        self
+        """
+        x, y, random_state = self._validate_partial_fit(x, y, classes)
+        order, protected = group_partition(protected_labels, y.size)
+        self._count_groups(protected, self._partial['n_calls'] > 0)
+        self._optimize_centered(x[order], y[order], protected, random_state)
+        self._partial['n_calls'] += 1
+        self._cache = None
+        return self
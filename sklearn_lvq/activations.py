@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+# License: BSD 3 clause
+
+"""Transfer functions used in the cost functions of the LVQ models.
+
+All functions operate elementwise on arrays as numpy ufuncs and are safe for
+large arguments, i.e. they neither overflow nor return nan.
+"""
+
+from __future__ import division
+
+import numpy as np
+from scipy.special import expit
+
+
+def sigmoid(x, beta=1):
+    """Logistic function 1 / (1 + exp(-beta * x)).
+
+    Parameters
+    ----------
+    x : array-like
+        Input values.
+    beta : int or float, optional (default=1)
+        Slope of the sigmoid.
+
+    Returns
+    -------
+    y : array
+        Sigmoid of x.
+    """
+    # beta * x may overflow to +-inf, where expit takes its limits 0 and 1
+    with np.errstate(over='ignore'):
+        return expit(np.multiply(beta, x))
+
+
+def sigmoid_prime(x, beta=1):
+    """Derivative of the logistic function with respect to x.
+
+    Parameters
+    ----------
+    x : array-like
+        Input values.
+    beta : int or float, optional (default=1)
+        Slope of the sigmoid.
+
+    Returns
+    -------
+    y : array
+        Derivative beta * s * (1 - s), where s is the sigmoid of x.
+    """
+    return sigmoid_and_prime(x, beta)[1]
+
+
+def sigmoid_and_prime(x, beta=1):
+    """Logistic function and its derivative, evaluating exp only once.
+
+    Parameters
+    ----------
+    x : array-like
+        Input values.
+    beta : int or float, optional (default=1)
+        Slope of the sigmoid.
+
+    Returns
+    -------
+    y : array
+        Sigmoid of x.
+    dy : array
+        Derivative of the sigmoid at x.
+    """
+    y = sigmoid(x, beta)
+    return y, beta * y * (1 - y)
+
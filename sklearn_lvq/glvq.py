@@ -7,25 +7,73 @@
 from __future__ import division
 
 import numpy as np
-from scipy.optimize import minimize
+from scipy import sparse
 from scipy.spatial.distance import cdist
 
 from sklearn.utils import validation
 from sklearn.utils.multiclass import unique_labels
-from sklearn.utils.validation import check_is_fitted
 from itertools import product
 
+from sklearn_lvq.activations import sigmoid, sigmoid_prime
 from sklearn_lvq.lvq import _LvqBaseModel
 
 
 def _squared_euclidean(a, b=None):
+    # |a|^2 + |b|^2 - 2ab cancels badly in single precision for points far
+    # from the origin, the models move float32 data next to the origin once
+    # per fit or predict block, see _LvqBaseModel._centered
     if b is None:
-        d = np.sum(a ** 2, 1)[np.newaxis].T + np.sum(a ** 2, 1) - 2 * a.dot(
-            a.T)
-    else:
-        d = np.sum(a ** 2, 1)[np.newaxis].T + np.sum(b ** 2, 1) - 2 * a.dot(
-            b.T)
-    return np.maximum(d, 0)
+        b = a
+    # row norms without an n_samples x n_features temporary
+    d = a.dot(b.T)
+    d *= -2
+    d += np.einsum('ij,ij->i', a, a)[np.newaxis].T
+    d += np.einsum('ij,ij->i', b, b)
+    return np.maximum(d, 0, out=d)
+
+
+def _winners(dist, label_equals_prototype):
+    """Distances to and indices of the closest correct and wrong prototypes.
+
+    Returns ``(dist, distcorrect, distwrong, pidxcorrect, pidxwrong)``, dist
+    itself is left untouched.
+    """
+    d_correct = np.where(label_equals_prototype, dist, np.inf)
+    pidxcorrect = d_correct.argmin(1)
+    d_wrong = np.where(label_equals_prototype, np.inf, dist)
+    pidxwrong = d_wrong.argmin(1)
+    rows = np.arange(dist.shape[0])
+    return (dist, d_correct[rows, pidxcorrect], d_wrong[rows, pidxwrong],
+            pidxcorrect, pidxwrong)
+
+
+def _prototype_gradient(training_data, prototypes, pidxcorrect, pidxwrong,
+                        dcd, dwd):
+    """Accumulate ``dcd * (x - w_wrong) - dwd * (x - w_correct)`` for every
+    prototype.
+
+    The per sample factors are scattered into a sparse prototype x sample
+    indicator matrix, so the whole gradient is a single sparse product
+    instead of one masked product per prototype.
+    """
+    n_data = training_data.shape[0]
+    nb_prototypes = prototypes.shape[0]
+    rows = np.append(pidxwrong, pidxcorrect)
+    coef = np.append(dcd, -dwd)
+    indicator = sparse.csr_matrix(
+        (coef, (rows, np.tile(np.arange(n_data), 2))),
+        shape=(nb_prototypes, n_data))
+    return indicator.dot(training_data) - np.bincount(
+        rows, coef, minlength=nb_prototypes)[np.newaxis].T * prototypes
+
+
+def _prototype_sums(pidx, values, nb_prototypes):
+    """Sums of the rows of values per prototype index in pidx, as one sparse
+    product like _prototype_gradient."""
+    indicator = sparse.csr_matrix(
+        (np.ones(pidx.size, dtype=values.dtype), (pidx, np.arange(pidx.size))),
+        shape=(nb_prototypes, pidx.size))
+    return indicator.dot(values)
 
 
 class GlvqModel(_LvqBaseModel):
@@ -44,7 +92,8 @@ class GlvqModel(_LvqBaseModel):
         means. Class label must be placed as last entry of each prototype.
 
     max_iter : int, optional (default=2500)
-        The maximum number of iterations.
+        The maximum number of iterations. For the stochastic solvers the
+        number of epochs.
 
     gtol : float, optional (default=1e-5)
         Gradient norm must be less than gtol before successful termination
@@ -68,6 +117,43 @@ class GlvqModel(_LvqBaseModel):
         If None, the random number generator is the RandomState instance used
         by `np.random`.
 
+    solver : {'l-bfgs-b', 'sgd', 'adam'}, optional (default='l-bfgs-b')
+        Optimizer. 'l-bfgs-b' minimizes the cost on the whole training set,
+        'sgd' and 'adam' run mini-batch gradient descent for max_iter epochs.
+
+    batch_size : int, optional (default=256)
+        Size of the mini-batches of the stochastic solvers.
+
+    learning_rate : {'constant', 'invscaling'}, optional (default='constant')
+        Step size schedule of the stochastic solvers. 'invscaling' divides
+        learning_rate_init by the square root of the epoch number.
+
+    learning_rate_init : float, optional (default=0.01)
+        Initial step size of the stochastic solvers.
+
+    chunk_size : int or None, optional (default=None)
+        Number of samples for which cost and gradient, or the distances in
+        predict and decision_function, are evaluated at once. Bounds the
+        memory used for distances and gradient terms, so large (e.g.
+        memory-mapped) data sets can be processed. None evaluates cost and
+        gradient on all samples at once, and the distances in predict and
+        decision_function in blocks of at most 4096 samples.
+
+    dtype : {np.float32, np.float64}, optional (default=np.float64)
+        Floating point type of the data, the prototypes, the relevances and
+        all intermediate distances. np.float32 halves the memory traffic of
+        the distance computations at the cost of precision.
+
+    n_jobs : int or None, optional (default=None)
+        Number of threads predict and decision_function use to process the
+        blocks of samples in parallel, and number of processes for the
+        n_init fits. None means 1, -1 means all processors.
+
+    n_init : int, optional (default=1)
+        Number of fits from different random initializations. The model
+        with the lowest final cost is kept. The fits run in n_jobs
+        processes, which share the training data as memory maps.
+
     Attributes
     ----------
 
@@ -88,11 +174,19 @@ class GlvqModel(_LvqBaseModel):
 
     def __init__(self, prototypes_per_class=1, initial_prototypes=None,
                  max_iter=2500, gtol=1e-5, beta=2, C=None,
-                 display=False, random_state=None):
+                 display=False, random_state=None,
+                 solver='l-bfgs-b', batch_size=256, learning_rate='constant',
+                 learning_rate_init=0.01, chunk_size=None, dtype=np.float64,
+                 n_jobs=None, n_init=1):
         super(GlvqModel, self).__init__(prototypes_per_class=prototypes_per_class,
                                         initial_prototypes=initial_prototypes,
                                         max_iter=max_iter, gtol=gtol, display=display,
-                                        random_state=random_state)
+                                        random_state=random_state,
+                                        solver=solver, batch_size=batch_size,
+                                        learning_rate=learning_rate,
+                                        learning_rate_init=learning_rate_init,
+                                        chunk_size=chunk_size, dtype=dtype,
+                                        n_jobs=n_jobs, n_init=n_init)
         self.beta = beta
         self.c = C
 
@@ -104,7 +198,7 @@ class GlvqModel(_LvqBaseModel):
         x : input value
 
         """
-        return 1 / (1 + np.exp(-self.beta * x))
+        return sigmoid(x, self.beta)
 
     def phi_prime(self, x):
         """
@@ -114,8 +208,7 @@ class GlvqModel(_LvqBaseModel):
         x : input value
 
         """
-        return self.beta * np.exp(self.beta * x) / (
-                1 + np.exp(self.beta * x)) ** 2
+        return sigmoid_prime(x, self.beta)
 
     def _optgrad(self, variables, training_data, label_equals_prototype,
                  random_state):
@@ -123,35 +216,22 @@ class GlvqModel(_LvqBaseModel):
         nb_prototypes = self.c_w_.size
         prototypes = variables.reshape(nb_prototypes, n_dim)
 
-        dist = _squared_euclidean(training_data, prototypes)
-        d_wrong = dist.copy()
-        d_wrong[label_equals_prototype] = np.inf
-        distwrong = d_wrong.min(1)
-        pidxwrong = d_wrong.argmin(1)
-
-        d_correct = dist
-        d_correct[np.invert(label_equals_prototype)] = np.inf
-        distcorrect = d_correct.min(1)
-        pidxcorrect = d_correct.argmin(1)
+        _, distcorrect, distwrong, pidxcorrect, pidxwrong = self._cached(
+            variables, training_data, lambda: _winners(
+                _squared_euclidean(training_data, prototypes),
+                label_equals_prototype))
 
         distcorrectpluswrong = distcorrect + distwrong
         distcorectminuswrong = distcorrect - distwrong
         mu = distcorectminuswrong / distcorrectpluswrong
-        mu = np.vectorize(self.phi_prime)(mu)
+        mu = self.phi_prime(mu)
 
-        g = np.zeros(prototypes.shape)
         distcorrectpluswrong = 4 / distcorrectpluswrong ** 2
 
-        for i in range(nb_prototypes):
-            idxc = i == pidxcorrect
-            idxw = i == pidxwrong
-
-            dcd = mu[idxw] * distcorrect[idxw] * distcorrectpluswrong[idxw]
-            dwd = mu[idxc] * distwrong[idxc] * distcorrectpluswrong[idxc]
-            g[i] = dcd.dot(training_data[idxw]) - dwd.dot(
-                training_data[idxc]) + (dwd.sum(0) -
-                                        dcd.sum(0)) * prototypes[i]
-        g[:nb_prototypes] = 1 / n_data * g[:nb_prototypes]
+        dcd = mu * distcorrect * distcorrectpluswrong
+        dwd = mu * distwrong * distcorrectpluswrong
+        g = 1 / n_data * _prototype_gradient(training_data, prototypes,
+                                             pidxcorrect, pidxwrong, dcd, dwd)
         g = g * (1 + 0.0001 * random_state.rand(*g.shape) - 0.5)
         return g.ravel()
 
@@ -160,28 +240,24 @@ class GlvqModel(_LvqBaseModel):
         nb_prototypes = self.c_w_.size
         prototypes = variables.reshape(nb_prototypes, n_dim)
 
-        dist = _squared_euclidean(training_data, prototypes)
-        d_wrong = dist.copy()
-        d_wrong[label_equals_prototype] = np.inf
-        distwrong = d_wrong.min(1)
-
-        d_correct = dist
-        d_correct[np.invert(label_equals_prototype)] = np.inf
-        distcorrect = d_correct.min(1)
+        _, distcorrect, distwrong, _, pidxwrong = self._cached(
+            variables, training_data, lambda: _winners(
+                _squared_euclidean(training_data, prototypes),
+                label_equals_prototype))
 
         distcorrectpluswrong = distcorrect + distwrong
         distcorectminuswrong = distcorrect - distwrong
         mu = distcorectminuswrong / distcorrectpluswrong
-        [self._map_to_int(x) for x in self.c_w_[label_equals_prototype.argmax(1)]]
-        mu *= self.c_[label_equals_prototype.argmax(1), d_wrong.argmin(1)]  # y_real, y_pred
+        mu *= self.c_[label_equals_prototype.argmax(1), pidxwrong]  # y_real, y_pred
 
-        return np.vectorize(self.phi)(mu).sum(0)
+        return self.phi(mu).sum(0)
 
-    def _validate_train_parms(self, train_set, train_lab):
+    def _validate_train_parms(self, train_set, train_lab, classes=None):
         if not isinstance(self.beta, int):
             raise ValueError("beta must a an integer")
 
-        ret = super(GlvqModel, self)._validate_train_parms(train_set, train_lab)
+        ret = super(GlvqModel, self)._validate_train_parms(train_set, train_lab,
+                                                           classes)
 
         self.c_ = np.ones((self.c_w_.size, self.c_w_.size))
         if self.c is not None:
@@ -197,17 +273,16 @@ class GlvqModel(_LvqBaseModel):
 
     def _optimize(self, x, y, random_state):
         label_equals_prototype = y[np.newaxis].T == self.c_w_
-        res = minimize(
-            fun=lambda vs: self._optfun(
+        res = self._minimize(
+            fun=lambda vs, x, lep: self._optfun(
                 variables=vs, training_data=x,
-                label_equals_prototype=label_equals_prototype),
-            jac=lambda vs: self._optgrad(
+                label_equals_prototype=lep),
+            jac=lambda vs, x, lep: self._optgrad(
                 variables=vs, training_data=x,
-                label_equals_prototype=label_equals_prototype,
+                label_equals_prototype=lep,
                 random_state=random_state),
-            method='l-bfgs-b', x0=self.w_,
-            options={'disp': self.display, 'gtol': self.gtol,
-                     'maxiter': self.max_iter})
+            x0=self.w_, data=(x, label_equals_prototype),
+            random_state=random_state)
         self.w_ = res.x.reshape(self.w_.shape)
         self.n_iter_ = res.nit
 
@@ -216,6 +291,13 @@ class GlvqModel(_LvqBaseModel):
             w = self.w_
         return cdist(x, w, 'euclidean')
 
+    def _squared_distance(self, x, w):
+        """Distances of x to the prototypes w in the units of the cost, used
+        by predict and decision_function. For GLVQ these are the squared
+        euclidean distances, which skip the square roots of
+        _compute_distance."""
+        return _squared_euclidean(x, w)
+
     def predict(self, x):
         """Predict class membership index for each input sample.
 
@@ -233,11 +315,45 @@ class GlvqModel(_LvqBaseModel):
         C : array, shape = (n_samples,)
             Returns predicted values.
         """
-        check_is_fitted(self, ['w_', 'c_w_'])
-        x = validation.check_array(x)
-        if x.shape[1] != self.w_.shape[1]:
-            raise ValueError("X has wrong number of features\n"
-                             "found=%d\n"
-                             "expected=%d" % (self.w_.shape[1], x.shape[1]))
-        dist = self._compute_distance(x)
-        return (self.c_w_[dist.argmin(1)])
+        x = self._check_x(x)
+        return self._blockwise(x, lambda block: self.c_w_[
+            self._squared_distance(*self._centered(block)).argmin(1)])
+
+    def decision_function(self, x):
+        """Relative distance scores for each input sample.
+
+        The score of a class is (d_other - d_class) / (d_other + d_class),
+        where d_class is the distance to the closest prototype of the class
+        and d_other the distance to the closest prototype of any other
+        class. It is positive for the predicted class only.
+
+        Parameters
+        ----------
+        x : array-like, shape = [n_samples, n_features]
+
+        Returns
+        -------
+        scores : array, shape = (n_samples,) or (n_samples, n_classes)
+            Scores of the classes, for two classes only the score of
+            classes_[1].
+        """
+        x = self._check_x(x)
+        scores = self._blockwise(x, self._decision_block)
+        if len(self.classes_) == 2:
+            return scores[:, 1]
+        return scores
+
+    def _decision_block(self, x):
+        dist = self._squared_distance(*self._centered(x))
+        nb_samples = dist.shape[0]
+        dclass = np.empty([nb_samples, len(self.classes_)], dtype=dist.dtype)
+        for i, c in enumerate(self.classes_):
+            dclass[:, i] = dist[:, self.c_w_ == c].min(1)
+        rows = np.arange(nb_samples)
+        best = dclass.argmin(1)
+        dbest = dclass[rows, best]
+        dclass[rows, best] = np.inf
+        dother = np.repeat(dbest[np.newaxis].T, dclass.shape[1], 1)
+        dother[rows, best] = dclass.min(1)
+        dclass[rows, best] = dbest
+        return (dother - dclass) / (dother + dclass)
@@ -10,9 +10,9 @@ import math
 from math import log
 
 import numpy as np
-from scipy.optimize import minimize
 
-from .glvq import GlvqModel
+from .glvq import GlvqModel, _winners, _prototype_gradient, \
+    _prototype_sums, _squared_euclidean
 from sklearn.utils import validation
 
 
@@ -45,7 +45,8 @@ class GmlvqModel(GlvqModel):
         Maximum rank or projection dimensions
 
     max_iter : int, optional (default=2500)
-        The maximum number of iterations.
+        The maximum number of iterations. For the stochastic solvers the
+        number of epochs.
 
     gtol : float, optional (default=1e-5)
         Gradient norm must be less than gtol before successful
@@ -69,6 +70,55 @@ class GmlvqModel(GlvqModel):
         If None, the random number generator is the RandomState instance used
         by `np.random`.
 
+    solver : {'l-bfgs-b', 'sgd', 'adam'}, optional (default='l-bfgs-b')
+        Optimizer. 'l-bfgs-b' minimizes the cost on the whole training set,
+        'sgd' and 'adam' run mini-batch gradient descent for max_iter epochs.
+
+    batch_size : int, optional (default=256)
+        Size of the mini-batches of the stochastic solvers.
+
+    learning_rate : {'constant', 'invscaling'}, optional (default='constant')
+        Step size schedule of the stochastic solvers. 'invscaling' divides
+        learning_rate_init by the square root of the epoch number.
+
+    learning_rate_init : float, optional (default=0.01)
+        Initial step size of the stochastic solvers.
+
+    chunk_size : int or None, optional (default=None)
+        Number of samples for which cost and gradient, or the distances in
+        predict and decision_function, are evaluated at once. Bounds the
+        memory used for distances and gradient terms, so large (e.g.
+        memory-mapped) data sets can be processed. None evaluates cost and
+        gradient on all samples at once, and the distances in predict and
+        decision_function in blocks of at most 4096 samples.
+
+    dtype : {np.float32, np.float64}, optional (default=np.float64)
+        Floating point type of the data, the prototypes, the relevances and
+        all intermediate distances. np.float32 halves the memory traffic of
+        the distance computations at the cost of precision.
+
+    n_jobs : int or None, optional (default=None)
+        Number of threads predict and decision_function use to process the
+        blocks of samples in parallel, and number of processes for the
+        n_init fits. None means 1, -1 means all processors.
+
+    n_init : int, optional (default=1)
+        Number of fits from different random initializations. The model
+        with the lowest final cost is kept. The fits run in n_jobs
+        processes, which share the training data as memory maps.
+
+    phases : list or None, optional (default=None)
+        Optimization phases, each 'prototypes', 'relevances' or 'all' (the
+        parameters optimized), or a pair of such a name and the maximum
+        number of iterations of the phase. The phases share the max_iter
+        iterations. None optimizes the prototypes, the relevances and both
+        in turn, each phase with max_iter iterations.
+
+    max_time : float or None, optional (default=None)
+        Time limit in seconds for all phases together. The solver returns
+        the last iterate once it is exceeded and later phases are skipped.
+        None means no limit.
+
     Attributes
     ----------
 
@@ -96,72 +146,67 @@ class GmlvqModel(GlvqModel):
     def __init__(self, prototypes_per_class=1, initial_prototypes=None,
                  initial_matrix=None, regularization=0.0, dim=None,
                  max_iter=2500, gtol=1e-5, beta=2, C=None, display=False,
-                 random_state=None):
+                 random_state=None,
+                 solver='l-bfgs-b', batch_size=256, learning_rate='constant',
+                 learning_rate_init=0.01, chunk_size=None, dtype=np.float64,
+                 n_jobs=None, n_init=1,
+                 phases=None, max_time=None):
         super(GmlvqModel, self).__init__(prototypes_per_class,
                                          initial_prototypes, max_iter,
-                                         gtol, beta, C, display, random_state)
+                                         gtol, beta, C, display, random_state,
+                                         solver, batch_size, learning_rate,
+                                         learning_rate_init, chunk_size, dtype,
+                                         n_jobs, n_init)
         self.regularization = regularization
         self.initial_matrix = initial_matrix
         self.initialdim = dim
+        self.phases = phases
+        self.max_time = max_time
 
     def _optgrad(self, variables, training_data, label_equals_prototype,
                  random_state, lr_relevances=0, lr_prototypes=1):
         n_data, n_dim = training_data.shape
         variables = variables.reshape(variables.size // n_dim, n_dim)
         nb_prototypes = self.c_w_.shape[0]
-        omega_t = variables[nb_prototypes:].conj().T
-        # dist = _squared_euclidean(training_data.dot(omega_t),
-        #                           variables[:nb_prototypes].dot(omega_t))
-        dist = self._compute_distance(training_data, variables[:nb_prototypes],
-                                      omega_t.T)
-        d_wrong = dist.copy()
-        d_wrong[label_equals_prototype] = np.inf
-        distwrong = d_wrong.min(1)
-        pidxwrong = d_wrong.argmin(1)
-
-        d_correct = dist
-        d_correct[np.invert(label_equals_prototype)] = np.inf
-        distcorrect = d_correct.min(1)
-        pidxcorrect = d_correct.argmin(1)
+        prototypes = variables[:nb_prototypes]
+        omega = variables[nb_prototypes:]
+        _, distcorrect, distwrong, pidxcorrect, pidxwrong, xp, wp = \
+            self._cached(variables, training_data,
+                         lambda: self._projected_winners(
+                             training_data, prototypes, omega,
+                             label_equals_prototype))
 
         distcorrectpluswrong = distcorrect + distwrong
         distcorectminuswrong = distcorrect - distwrong
         mu = distcorectminuswrong / distcorrectpluswrong
-        mu = np.vectorize(self.phi_prime)(mu)
-        mu *= self.c_[label_equals_prototype.argmax(1), d_wrong.argmin(1)]
+        mu = self.phi_prime(mu)
+        mu *= self.c_[label_equals_prototype.argmax(1), pidxwrong]
 
-        g = np.zeros(variables.shape)
+        g = np.zeros_like(variables)
         distcorrectpluswrong = 4 / distcorrectpluswrong ** 2
 
+        dcd = mu * distcorrect * distcorrectpluswrong
+        dwd = mu * distwrong * distcorrectpluswrong
         if lr_relevances > 0:
-            gw = np.zeros(omega_t.T.shape)
-
-        for i in range(nb_prototypes):
-            idxc = i == pidxcorrect
-            idxw = i == pidxwrong
-
-            dcd = mu[idxw] * distcorrect[idxw] * distcorrectpluswrong[idxw]
-            dwd = mu[idxc] * distwrong[idxc] * distcorrectpluswrong[idxc]
-            if lr_relevances > 0:
-                difc = training_data[idxc] - variables[i]
-                difw = training_data[idxw] - variables[i]
-                gw -= np.dot(difw * dcd[np.newaxis].T, omega_t).T.dot(difw) - \
-                      np.dot(difc * dwd[np.newaxis].T, omega_t).T.dot(difc)
-                if lr_prototypes > 0:
-                    g[i] = dcd.dot(difw) - dwd.dot(difc)
-            elif lr_prototypes > 0:
-                g[i] = dcd.dot(training_data[idxw]) - \
-                       dwd.dot(training_data[idxc]) + \
-                       (dwd.sum(0) - dcd.sum(0)) * variables[i]
-        f3 = 0
-        if self.regularization:
-            f3 = np.linalg.pinv(omega_t.conj().T).conj().T
-        if lr_relevances > 0:
+            # omega (x - w)(x - w)^T summed over the winners, from the
+            # projected differences omega (x - w) = xp - wp
+            projwrong = dcd[np.newaxis].T * (xp - wp[pidxwrong])
+            projcorrect = dwd[np.newaxis].T * (xp - wp[pidxcorrect])
+            weights = _prototype_sums(pidxwrong, projwrong, nb_prototypes) - \
+                _prototype_sums(pidxcorrect, projcorrect, nb_prototypes)
+            gw = weights.T.dot(prototypes) - \
+                (projwrong - projcorrect).T.dot(training_data)
+            f3 = 0
+            if self.regularization:
+                f3 = np.linalg.pinv(omega).conj().T
             g[nb_prototypes:] = 2 / n_data \
                                 * lr_relevances * gw - self.regularization * f3
         if lr_prototypes > 0:
+            # the gradient times omega^T omega, taken in the projected space
             g[:nb_prototypes] = 1 / n_data * lr_prototypes \
-                                * g[:nb_prototypes].dot(omega_t.dot(omega_t.T))
+                                * _prototype_gradient(xp, wp, pidxcorrect,
+                                                      pidxwrong, dcd,
+                                                      dwd).dot(omega)
         g = g * (1 + 0.0001 * random_state.rand(*g.shape) - 0.5)
         return g.ravel()
 
@@ -169,19 +214,12 @@ class GmlvqModel(GlvqModel):
         n_data, n_dim = training_data.shape
         variables = variables.reshape(variables.size // n_dim, n_dim)
         nb_prototypes = self.c_w_.shape[0]
-        omega_t = variables[nb_prototypes:]  # .conj().T
-
-        # dist = _squared_euclidean(training_data.dot(omega_t),
-        #                           variables[:nb_prototypes].dot(omega_t))
-        dist = self._compute_distance(training_data, variables[:nb_prototypes],
-                                      omega_t)
-        d_wrong = dist.copy()
-        d_wrong[label_equals_prototype] = np.inf
-        distwrong = d_wrong.min(1)
+        prototypes = variables[:nb_prototypes]
+        omega = variables[nb_prototypes:]
 
-        d_correct = dist
-        d_correct[np.invert(label_equals_prototype)] = np.inf
-        distcorrect = d_correct.min(1)
+        _, distcorrect, distwrong, _, _, _, _ = self._cached(
+            variables, training_data, lambda: self._projected_winners(
+                training_data, prototypes, omega, label_equals_prototype))
 
         distcorrectpluswrong = distcorrect + distwrong
         distcorectminuswrong = distcorrect - distwrong
@@ -189,9 +227,18 @@ class GmlvqModel(GlvqModel):
 
         if self.regularization > 0:
             reg_term = self.regularization * log(
-                np.linalg.det(omega_t.conj().T.dot(omega_t)))
-            return np.vectorize(self.phi)(mu).sum(0) - reg_term  # f
-        return np.vectorize(self.phi)(mu).sum(0)
+                np.linalg.det(omega.conj().T.dot(omega)))
+            return self.phi(mu).sum(0) - reg_term  # f
+        return self.phi(mu).sum(0)
+
+    def _projected_winners(self, training_data, prototypes, omega,
+                           label_equals_prototype):
+        """_winners of the distances in the projected space, followed by the
+        projected data and prototypes."""
+        xp = training_data.dot(omega.T)
+        wp = prototypes.dot(omega.T)
+        return _winners(_squared_euclidean(xp, wp),
+                        label_equals_prototype) + (xp, wp)
 
     def _optimize(self, x, y, random_state):
         if not isinstance(self.regularization,
@@ -205,55 +252,34 @@ class GmlvqModel(GlvqModel):
         else:
             self.dim_ = self.initialdim
 
-        if self.initial_matrix is None:
-            if self.dim_ == nb_features:
-                self.omega_ = np.eye(nb_features)
+        if not self._warm_start():
+            if self.initial_matrix is None:
+                if self.dim_ == nb_features:
+                    self.omega_ = np.eye(nb_features)
+                else:
+                    self.omega_ = random_state.rand(
+                        self.dim_, nb_features) * 2 - 1
             else:
-                self.omega_ = random_state.rand(self.dim_, nb_features) * 2 - 1
-        else:
-            self.omega_ = validation.check_array(self.initial_matrix)
-            if self.omega_.shape[1] != nb_features:  # TODO: check dim
-                raise ValueError(
-                    "initial matrix has wrong number of features\n"
-                    "found=%d\n"
-                    "expected=%d" % (self.omega_.shape[1], nb_features))
+                self.omega_ = validation.check_array(self.initial_matrix)
+                if self.omega_.shape[1] != nb_features:  # TODO: check dim
+                    raise ValueError(
+                        "initial matrix has wrong number of features\n"
+                        "found=%d\n"
+                        "expected=%d" % (self.omega_.shape[1], nb_features))
 
         variables = np.append(self.w_, self.omega_, axis=0)
         label_equals_prototype = y[np.newaxis].T == self.c_w_
         method = 'l-bfgs-b'
-        res = minimize(
-            fun=lambda vs:
-            self._optfun(vs, x, label_equals_prototype=label_equals_prototype),
-            jac=lambda vs:
-            self._optgrad(vs, x, label_equals_prototype=label_equals_prototype,
-                          random_state=random_state,
-                          lr_prototypes=1, lr_relevances=0),
+        res = self._minimize_phases(
+            fun=lambda vs, x, lep: self._optfun(
+                vs, x, label_equals_prototype=lep),
+            jac=lambda vs, x, lep, **lr: self._optgrad(
+                vs, x, label_equals_prototype=lep,
+                random_state=random_state, **lr),
             method=method, x0=variables,
-            options={'disp': self.display, 'gtol': self.gtol,
-                     'maxiter': self.max_iter})
+            data=(x, label_equals_prototype),
+            random_state=random_state)
         n_iter = res.nit
-        res = minimize(
-            fun=lambda vs:
-            self._optfun(vs, x, label_equals_prototype=label_equals_prototype),
-            jac=lambda vs:
-            self._optgrad(vs, x, label_equals_prototype=label_equals_prototype,
-                          random_state=random_state,
-                          lr_prototypes=0, lr_relevances=1),
-            method=method, x0=res.x,
-            options={'disp': self.display, 'gtol': self.gtol,
-                     'maxiter': self.max_iter})
-        n_iter = max(n_iter, res.nit)
-        res = minimize(
-            fun=lambda vs:
-            self._optfun(vs, x, label_equals_prototype=label_equals_prototype),
-            jac=lambda vs:
-            self._optgrad(vs, x, label_equals_prototype=label_equals_prototype,
-                          random_state=random_state,
-                          lr_prototypes=1, lr_relevances=1),
-            method=method, x0=res.x,
-            options={'disp': self.display, 'gtol': self.gtol,
-                     'maxiter': self.max_iter})
-        n_iter = max(n_iter, res.nit)
         out = res.x.reshape(res.x.size // nb_features, nb_features)
         self.w_ = out[:nb_prototypes]
         self.omega_ = out[nb_prototypes:]
@@ -261,17 +287,17 @@ class GmlvqModel(GlvqModel):
             np.sum(np.diag(self.omega_.T.dot(self.omega_))))
         self.n_iter_ = n_iter
 
+    def _squared_distance(self, x, w):
+        # the relevance distances of _compute_distance are squared already
+        return self._compute_distance(x, w)
+
     def _compute_distance(self, x, w=None, omega=None):
         if w is None:
             w = self.w_
         if omega is None:
             omega = self.omega_
-        nb_samples = x.shape[0]
-        nb_prototypes = w.shape[0]
-        distance = np.zeros([nb_prototypes, nb_samples])
-        for i in range(nb_prototypes):
-            distance[i] = np.sum((x - w[i]).dot(omega.T) ** 2, 1)
-        return distance.T
+        # with dim < n_features the distances are cheaper in the projection
+        return _squared_euclidean(x.dot(omega.T), w.dot(omega.T))
 
     def project(self, x, dims, print_variance_covered=False):
         """Projects the data input data X using the relevance matrix of trained
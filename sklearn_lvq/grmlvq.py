@@ -10,9 +10,9 @@ import math
 from math import log
 
 import numpy as np
-from scipy.optimize import minimize
 
-from .glvq import GlvqModel
+from .glvq import GlvqModel, _winners, _prototype_gradient, \
+    _squared_euclidean
 from sklearn.utils import validation
 
 
@@ -48,7 +48,8 @@ class GrmlvqModel(GlvqModel):
         Maximum rank or projection dimensions
 
     max_iter : int, optional (default=2500)
-        The maximum number of iterations.
+        The maximum number of iterations. For the stochastic solvers the
+        number of epochs.
 
     gtol : float, optional (default=1e-5)
         Gradient norm must be less than gtol before successful
@@ -72,6 +73,55 @@ class GrmlvqModel(GlvqModel):
         If None, the random number generator is the RandomState instance used
         by `np.random`.
 
+    solver : {'l-bfgs-b', 'sgd', 'adam'}, optional (default='l-bfgs-b')
+        Optimizer. 'l-bfgs-b' minimizes the cost on the whole training set,
+        'sgd' and 'adam' run mini-batch gradient descent for max_iter epochs.
+
+    batch_size : int, optional (default=256)
+        Size of the mini-batches of the stochastic solvers.
+
+    learning_rate : {'constant', 'invscaling'}, optional (default='constant')
+        Step size schedule of the stochastic solvers. 'invscaling' divides
+        learning_rate_init by the square root of the epoch number.
+
+    learning_rate_init : float, optional (default=0.01)
+        Initial step size of the stochastic solvers.
+
+    chunk_size : int or None, optional (default=None)
+        Number of samples for which cost and gradient, or the distances in
+        predict and decision_function, are evaluated at once. Bounds the
+        memory used for distances and gradient terms, so large (e.g.
+        memory-mapped) data sets can be processed. None evaluates cost and
+        gradient on all samples at once, and the distances in predict and
+        decision_function in blocks of at most 4096 samples.
+
+    dtype : {np.float32, np.float64}, optional (default=np.float64)
+        Floating point type of the data, the prototypes, the relevances and
+        all intermediate distances. np.float32 halves the memory traffic of
+        the distance computations at the cost of precision.
+
+    n_jobs : int or None, optional (default=None)
+        Number of threads predict and decision_function use to process the
+        blocks of samples in parallel, and number of processes for the
+        n_init fits. None means 1, -1 means all processors.
+
+    n_init : int, optional (default=1)
+        Number of fits from different random initializations. The model
+        with the lowest final cost is kept. The fits run in n_jobs
+        processes, which share the training data as memory maps.
+
+    phases : list or None, optional (default=None)
+        Optimization phases, each 'prototypes', 'relevances' or 'all' (the
+        parameters optimized), or a pair of such a name and the maximum
+        number of iterations of the phase. The phases share the max_iter
+        iterations. None optimizes the prototypes, the relevances and both
+        in turn, each phase with max_iter iterations.
+
+    max_time : float or None, optional (default=None)
+        Time limit in seconds for all phases together. The solver returns
+        the last iterate once it is exceeded and later phases are skipped.
+        None means no limit.
+
     Attributes
     ----------
 
@@ -99,68 +149,69 @@ class GrmlvqModel(GlvqModel):
     def __init__(self, prototypes_per_class=1, initial_prototypes=None,
                  initial_relevances=None, initial_matrix=None,
                  regularization=0.0, dim=None, max_iter=2500, gtol=1e-5,
-                 beta=2, C=None, display=False, random_state=None):
+                 beta=2, C=None, display=False, random_state=None,
+                 solver='l-bfgs-b', batch_size=256, learning_rate='constant',
+                 learning_rate_init=0.01, chunk_size=None, dtype=np.float64,
+                 n_jobs=None, n_init=1,
+                 phases=None, max_time=None):
         super(GrmlvqModel, self).__init__(prototypes_per_class,
                                           initial_prototypes, max_iter,
-                                          gtol, beta, C, display, random_state)
+                                          gtol, beta, C, display, random_state,
+                                          solver, batch_size, learning_rate,
+                                          learning_rate_init, chunk_size,
+                                          dtype, n_jobs, n_init)
         self.regularization = regularization
         self.initial_relevances = initial_relevances
         self.initial_matrix = initial_matrix
         self.initialdim = dim
+        self.phases = phases
+        self.max_time = max_time
 
     def _optgrad(self, variables, training_data, label_equals_prototype,
                  random_state, lr_relevances=0, lr_prototypes=1):
         n_data, n_dim = training_data.shape
         nb_prototypes = self.c_w_.shape[0]
         lambd = variables[-n_dim:]
+        all_variables = variables
         variables = variables[:-n_dim]
         variables = variables.reshape(variables.size // n_dim, n_dim)
         omega_t = variables[nb_prototypes:].conj().T
         # dist = _squared_euclidean(training_data.dot(omega_t),
         #                           variables[:nb_prototypes].dot(omega_t))
-        dist = self._compute_distance(training_data, variables[:nb_prototypes],
-                                      lambd, omega_t.T)
-        d_wrong = dist.copy()
-        d_wrong[label_equals_prototype] = np.inf
-        distwrong = d_wrong.min(1)
-        pidxwrong = d_wrong.argmin(1)
-
-        d_correct = dist
-        d_correct[np.invert(label_equals_prototype)] = np.inf
-        distcorrect = d_correct.min(1)
-        pidxcorrect = d_correct.argmin(1)
+        _, distcorrect, distwrong, pidxcorrect, pidxwrong = self._cached(
+            all_variables, training_data, lambda: _winners(
+                self._compute_distance(training_data,
+                                       variables[:nb_prototypes], lambd,
+                                       omega_t.T),
+                label_equals_prototype))
 
         distcorrectpluswrong = distcorrect + distwrong
         distcorectminuswrong = distcorrect - distwrong
         mu = distcorectminuswrong / distcorrectpluswrong
-        mu = np.vectorize(self.phi_prime)(mu)
-        mu *= self.c_[label_equals_prototype.argmax(1), d_wrong.argmin(1)]
+        mu = self.phi_prime(mu)
+        mu *= self.c_[label_equals_prototype.argmax(1), pidxwrong]
 
-        g = np.zeros(variables.shape)
+        g = np.zeros_like(variables)
         distcorrectpluswrong = 4 / distcorrectpluswrong ** 2
-        gr = np.zeros(lambd.size)
+        gr = np.zeros_like(lambd)
+
+        if lr_relevances > 0:
+            gw = np.zeros(omega_t.T.shape, dtype=omega_t.dtype)
 
+        dcd = mu * distcorrect * distcorrectpluswrong
+        dwd = mu * distwrong * distcorrectpluswrong
         if lr_relevances > 0:
-            gw = np.zeros(omega_t.T.shape)
-
-        for i in range(nb_prototypes):
-            idxc = i == pidxcorrect
-            idxw = i == pidxwrong
-
-            dcd = mu[idxw] * distcorrect[idxw] * distcorrectpluswrong[idxw]
-            dwd = mu[idxc] * distwrong[idxc] * distcorrectpluswrong[idxc]
-            if lr_relevances > 0:
-                difc = training_data[idxc] - variables[i]
-                difw = training_data[idxw] - variables[i]
-                gr -= dcd.dot(difw ** 2) - dwd.dot(difc ** 2)
-                gw -= np.dot(difw * dcd[np.newaxis].T, omega_t).T.dot(difw) - \
-                      np.dot(difc * dwd[np.newaxis].T, omega_t).T.dot(difc)
-                if lr_prototypes > 0:
-                    g[i] = dcd.dot(difw) - dwd.dot(difc)
-            elif lr_prototypes > 0:
-                g[i] = dcd.dot(training_data[idxw]) - \
-                       dwd.dot(training_data[idxc]) + \
-                       (dwd.sum(0) - dcd.sum(0)) * variables[i]
+            # differences to the wrong and the correct winner of all samples,
+            # signed and weighted, enter one weighted gram matrix
+            dif = np.append(training_data - variables[pidxwrong],
+                            training_data - variables[pidxcorrect], axis=0)
+            weighted = np.append(dcd, -dwd)[np.newaxis].T * dif
+            gr -= np.einsum('ij,ij->j', weighted, dif)
+            gw -= omega_t.T.dot(weighted.T.dot(dif))
+        if lr_prototypes > 0:
+            g[:nb_prototypes] = _prototype_gradient(
+                training_data, variables[:nb_prototypes], pidxcorrect,
+                pidxwrong, dcd, dwd)
         f3 = 0
         f3r = 0
         if self.regularization:
@@ -182,21 +233,19 @@ class GrmlvqModel(GlvqModel):
         n_data, n_dim = training_data.shape
         nb_prototypes = self.c_w_.shape[0]
         lambd = variables[-n_dim:]
+        all_variables = variables
         variables = variables[:-n_dim]
         variables = variables.reshape(variables.size // n_dim, n_dim)
         omega_t = variables[nb_prototypes:]  # .conj().T
 
         # dist = _squared_euclidean(training_data.dot(omega_t),
         #                           variables[:nb_prototypes].dot(omega_t))
-        dist = self._compute_distance(training_data, variables[:nb_prototypes],
-                                      lambd, omega_t)
-        d_wrong = dist.copy()
-        d_wrong[label_equals_prototype] = np.inf
-        distwrong = d_wrong.min(1)
-
-        d_correct = dist
-        d_correct[np.invert(label_equals_prototype)] = np.inf
-        distcorrect = d_correct.min(1)
+        _, distcorrect, distwrong, _, _ = self._cached(
+            all_variables, training_data, lambda: _winners(
+                self._compute_distance(training_data,
+                                       variables[:nb_prototypes], lambd,
+                                       omega_t),
+                label_equals_prototype))
 
         distcorrectpluswrong = distcorrect + distwrong
         distcorectminuswrong = distcorrect - distwrong
@@ -205,25 +254,26 @@ class GrmlvqModel(GlvqModel):
         if self.regularization > 0:
             reg_term = self.regularization * log(
                 np.linalg.det(omega_t.conj().T.dot(omega_t)))
-            return np.vectorize(self.phi)(mu).sum(0) - reg_term  # f
-        return np.vectorize(self.phi)(mu).sum(0)
+            return self.phi(mu).sum(0) - reg_term  # f
+        return self.phi(mu).sum(0)
 
     def _optimize(self, x, y, random_state):
         if not isinstance(self.regularization,
                           float) or self.regularization < 0:
             raise ValueError("regularization must be a positive float ")
         nb_prototypes, nb_features = self.w_.shape
-        if self.initial_relevances is None:
-            self.lambda_ = np.ones([nb_features])
-        else:
-            self.lambda_ = validation.column_or_1d(
-                validation.check_array(self.initial_relevances, dtype='float',
-                                       ensure_2d=False))
-            if self.lambda_.size != nb_features:
-                raise ValueError("length of initial relevances is wrong"
-                                 "features=%d"
-                                 "length=%d" % (
-                                     nb_features, self.lambda_.size))
+        if not self._warm_start():
+            if self.initial_relevances is None:
+                self.lambda_ = np.ones([nb_features])
+            else:
+                self.lambda_ = validation.column_or_1d(
+                    validation.check_array(self.initial_relevances,
+                                           dtype='float', ensure_2d=False))
+                if self.lambda_.size != nb_features:
+                    raise ValueError("length of initial relevances is wrong"
+                                     "features=%d"
+                                     "length=%d" % (
+                                         nb_features, self.lambda_.size))
 
         if self.initialdim is None:
             self.dim_ = nb_features
@@ -232,56 +282,35 @@ class GrmlvqModel(GlvqModel):
         else:
             self.dim_ = self.initialdim
 
-        if self.initial_matrix is None:
-            if self.dim_ == nb_features:
-                self.omega_ = np.eye(nb_features)
+        if not self._warm_start():
+            if self.initial_matrix is None:
+                if self.dim_ == nb_features:
+                    self.omega_ = np.eye(nb_features)
+                else:
+                    self.omega_ = random_state.rand(
+                        self.dim_, nb_features) * 2 - 1
             else:
-                self.omega_ = random_state.rand(self.dim_, nb_features) * 2 - 1
-        else:
-            self.omega_ = validation.check_array(self.initial_matrix)
-            if self.omega_.shape[1] != nb_features:  # TODO: check dim
-                raise ValueError(
-                    "initial matrix has wrong number of features\n"
-                    "found=%d\n"
-                    "expected=%d" % (self.omega_.shape[1], nb_features))
+                self.omega_ = validation.check_array(self.initial_matrix)
+                if self.omega_.shape[1] != nb_features:  # TODO: check dim
+                    raise ValueError(
+                        "initial matrix has wrong number of features\n"
+                        "found=%d\n"
+                        "expected=%d" % (self.omega_.shape[1], nb_features))
 
         variables = np.append(self.w_, self.omega_, axis=0)
         variables = np.append(variables.ravel(), self.lambda_, axis=0)
         label_equals_prototype = y[np.newaxis].T == self.c_w_
         method = 'l-bfgs-b'
-        res = minimize(
-            fun=lambda vs:
-            self._optfun(vs, x, label_equals_prototype=label_equals_prototype),
-            jac=lambda vs:
-            self._optgrad(vs, x, label_equals_prototype=label_equals_prototype,
-                          random_state=random_state,
-                          lr_prototypes=1, lr_relevances=0),
+        res = self._minimize_phases(
+            fun=lambda vs, x, lep: self._optfun(
+                vs, x, label_equals_prototype=lep),
+            jac=lambda vs, x, lep, **lr: self._optgrad(
+                vs, x, label_equals_prototype=lep,
+                random_state=random_state, **lr),
             method=method, x0=variables,
-            options={'disp': self.display, 'gtol': self.gtol,
-                     'maxiter': self.max_iter})
+            data=(x, label_equals_prototype),
+            random_state=random_state)
         n_iter = res.nit
-        res = minimize(
-            fun=lambda vs:
-            self._optfun(vs, x, label_equals_prototype=label_equals_prototype),
-            jac=lambda vs:
-            self._optgrad(vs, x, label_equals_prototype=label_equals_prototype,
-                          random_state=random_state,
-                          lr_prototypes=0, lr_relevances=1),
-            method=method, x0=res.x,
-            options={'disp': self.display, 'gtol': self.gtol,
-                     'maxiter': self.max_iter})
-        n_iter = max(n_iter, res.nit)
-        res = minimize(
-            fun=lambda vs:
-            self._optfun(vs, x, label_equals_prototype=label_equals_prototype),
-            jac=lambda vs:
-            self._optgrad(vs, x, label_equals_prototype=label_equals_prototype,
-                          random_state=random_state,
-                          lr_prototypes=1, lr_relevances=1),
-            method=method, x0=res.x,
-            options={'disp': self.display, 'gtol': self.gtol,
-                     'maxiter': self.max_iter})
-        n_iter = max(n_iter, res.nit)
         self.lambda_ = res.x[-nb_features:]
         self.lambda_[self.lambda_ < 0] = 0.0000001
         self.lambda_ = self.lambda_ / self.lambda_.sum()
@@ -292,21 +321,26 @@ class GrmlvqModel(GlvqModel):
             np.sum(np.diag(self.omega_.T.dot(self.omega_))))
         self.n_iter_ = n_iter
 
+    def _squared_distance(self, x, w):
+        # the relevance distances are squared already; the transformed
+        # prototypes are kept for all predict blocks
+        return _squared_euclidean(
+            (x * self.lambda_).dot(self.omega_.T), self._model_cached(
+                lambda: (w * self.lambda_).dot(self.omega_.T),
+                w, self.lambda_, self.omega_))
+
     def _compute_distance(self, x, w=None, lambda_=None, omega=None):
+        # squared euclidean distance of the transformed x * lambda_ . omega^T
+        if w is None and lambda_ is None and omega is None:
+            return self._squared_distance(x, self.w_)
         if w is None:
             w = self.w_
         if lambda_ is None:
             lambda_ = self.lambda_
         if omega is None:
             omega = self.omega_
-        x = lambda_ * x
-        w = lambda_ * w
-        nb_samples = x.shape[0]
-        nb_prototypes = w.shape[0]
-        distance = np.zeros([nb_prototypes, nb_samples])
-        for i in range(nb_prototypes):
-            distance[i] = np.sum((x - w[i]).dot(omega.T) ** 2, 1)
-        return distance.T
+        return _squared_euclidean((x * lambda_).dot(omega.T),
+                                  (w * lambda_).dot(omega.T))
 
     def project(self, x, dims, print_variance_covered=False):
         """Projects the data input data X using the relevance matrix of trained
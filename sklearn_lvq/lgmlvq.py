@@ -7,11 +7,62 @@
 from __future__ import division
 
 import numpy as np
-from scipy.optimize import minimize
 
-from .glvq import GlvqModel
+from .glvq import GlvqModel, _winners, _prototype_gradient
 from sklearn.utils import validation
 
+# number of projected differences held at once, the samples are projected in
+# blocks of at most this many entries of [n_samples, n_prototypes, max(dim_)]
+_PROJECTION_BLOCK = 2 ** 16
+
+
+def _projection_blocks(nb_samples, psis):
+    """Row slices covering nb_samples, with at most _PROJECTION_BLOCK
+    projected differences on all local matrices psis per slice."""
+    step = max(_PROJECTION_BLOCK // (psis.shape[0] * psis.shape[1]), 1)
+    return [slice(start, start + step)
+            for start in range(0, max(nb_samples, 1), step)]
+
+
+def _projected(x, prototypes, psis):
+    """Differences psi_j (x_i - w_j) of all samples to all prototypes, of
+    shape [n_samples, n_prototypes, max(dim_)]."""
+    nb_prototypes, dim, nb_features = psis.shape
+    projected = x.dot(psis.reshape(-1, nb_features).T).reshape(
+        x.shape[0], nb_prototypes, dim)
+    projected -= np.einsum('pdf,pf->pd', psis, prototypes)
+    return projected
+
+
+def _relevance_gradient(training_data, prototypes, projcorrect, projwrong,
+                        pidxcorrect, pidxwrong, dcd, dwd):
+    """Accumulate ``dcd * psi (x - w_wrong)(x - w_wrong)^T - dwd * psi
+    (x - w_correct)(x - w_correct)^T`` for the local matrix psi of every
+    prototype.
+
+    The samples are grouped by their closest correct and closest wrong
+    prototype, every group adds one product of its weighted projected
+    differences with its differences x - w. The groups are processed in
+    slices of at most _PROJECTION_BLOCK entries. Returns an array of shape
+    [n_prototypes, max(dim_), n_features].
+    """
+    nb_prototypes, nb_features = prototypes.shape
+    dim = projcorrect.shape[1]
+    gradient = np.zeros((nb_prototypes, dim, nb_features),
+                        dtype=np.result_type(training_data, projcorrect))
+    step = max(_PROJECTION_BLOCK // max(nb_features, dim), 1)
+    for pidx, projected, weights in ((pidxwrong, projwrong, dcd),
+                                     (pidxcorrect, projcorrect, -dwd)):
+        order = np.argsort(pidx, kind='mergesort')
+        bounds = np.searchsorted(pidx[order], np.arange(nb_prototypes + 1))
+        for j in range(nb_prototypes):
+            for start in range(bounds[j], bounds[j + 1], step):
+                samples = order[start:min(start + step, bounds[j + 1])]
+                gradient[j] += (weights[samples, np.newaxis] *
+                                projected[samples]).T.dot(
+                    training_data[samples] - prototypes[j])
+    return gradient
+
 
 class LgmlvqModel(GlvqModel):
     """Localized Generalized Matrix Learning Vector Quantization
@@ -45,7 +96,8 @@ class LgmlvqModel(GlvqModel):
         If false, each prototype has one relevance matrix.
 
     max_iter : int, optional (default=2500)
-        The maximum number of iterations.
+        The maximum number of iterations. For the stochastic solvers the
+        number of epochs.
 
     gtol : float, optional (default=1e-5)
         Gradient norm must be less than gtol before successful termination
@@ -69,6 +121,55 @@ class LgmlvqModel(GlvqModel):
         If None, the random number generator is the RandomState instance used
         by `np.random`.
 
+    solver : {'l-bfgs-b', 'sgd', 'adam'}, optional (default='l-bfgs-b')
+        Optimizer. 'l-bfgs-b' minimizes the cost on the whole training set,
+        'sgd' and 'adam' run mini-batch gradient descent for max_iter epochs.
+
+    batch_size : int, optional (default=256)
+        Size of the mini-batches of the stochastic solvers.
+
+    learning_rate : {'constant', 'invscaling'}, optional (default='constant')
+        Step size schedule of the stochastic solvers. 'invscaling' divides
+        learning_rate_init by the square root of the epoch number.
+
+    learning_rate_init : float, optional (default=0.01)
+        Initial step size of the stochastic solvers.
+
+    chunk_size : int or None, optional (default=None)
+        Number of samples for which cost and gradient, or the distances in
+        predict and decision_function, are evaluated at once. Bounds the
+        memory used for distances and gradient terms, so large (e.g.
+        memory-mapped) data sets can be processed. None evaluates cost and
+        gradient on all samples at once, and the distances in predict and
+        decision_function in blocks of at most 4096 samples.
+
+    dtype : {np.float32, np.float64}, optional (default=np.float64)
+        Floating point type of the data, the prototypes, the relevances and
+        all intermediate distances. np.float32 halves the memory traffic of
+        the distance computations at the cost of precision.
+
+    n_jobs : int or None, optional (default=None)
+        Number of threads predict and decision_function use to process the
+        blocks of samples in parallel, and number of processes for the
+        n_init fits. None means 1, -1 means all processors.
+
+    n_init : int, optional (default=1)
+        Number of fits from different random initializations. The model
+        with the lowest final cost is kept. The fits run in n_jobs
+        processes, which share the training data as memory maps.
+
+    phases : list or None, optional (default=None)
+        Optimization phases, each 'prototypes', 'relevances' or 'all' (the
+        parameters optimized), or a pair of such a name and the maximum
+        number of iterations of the phase. The phases share the max_iter
+        iterations. None optimizes the prototypes, the relevances and both
+        in turn, each phase with max_iter iterations.
+
+    max_time : float or None, optional (default=None)
+        Time limit in seconds for all phases together. The solver returns
+        the last iterate once it is exceeded and later phases are skipped.
+        None means no limit.
+
     Attributes
     ----------
 
@@ -99,14 +200,23 @@ class LgmlvqModel(GlvqModel):
     def __init__(self, prototypes_per_class=1, initial_prototypes=None,
                  initial_matrices=None, regularization=0.0,
                  dim=None, classwise=False, max_iter=2500, gtol=1e-5,
-                 beta=2, C=None, display=False, random_state=None):
+                 beta=2, C=None, display=False, random_state=None,
+                 solver='l-bfgs-b', batch_size=256, learning_rate='constant',
+                 learning_rate_init=0.01, chunk_size=None, dtype=np.float64,
+                 n_jobs=None, n_init=1,
+                 phases=None, max_time=None):
         super(LgmlvqModel, self).__init__(prototypes_per_class,
                                           initial_prototypes, max_iter,
-                                          gtol, beta, C, display, random_state)
+                                          gtol, beta, C, display, random_state,
+                                          solver, batch_size, learning_rate,
+                                          learning_rate_init, chunk_size,
+                                          dtype, n_jobs, n_init)
         self.regularization = regularization
         self.initial_matrices = initial_matrices
         self.classwise = classwise
         self.initialdim = dim
+        self.phases = phases
+        self.max_time = max_time
 
     def _g(self, variables, training_data, label_equals_prototype,
            random_state, lr_relevances=0,
@@ -116,71 +226,46 @@ class LgmlvqModel(GlvqModel):
         nb_prototypes = self.c_w_.shape[0]
         variables = variables.reshape(variables.size // nb_features,
                                       nb_features)
-        # dim to indices
-        indices = []
-        for i in range(len(self.dim_)):
-            indices.append(sum(self.dim_[:i + 1]))
-        psis = np.split(variables[nb_prototypes:], indices[:-1])  # .conj().T
-
-        dist = self._compute_distance(training_data, variables[:nb_prototypes],
-                                      psis)  # change dist function ?
-        # dist = cdist(training_data, prototypes, 'sqeuclidean')
-        d_wrong = dist.copy()
-        d_wrong[label_equals_prototype] = np.inf
-        distwrong = d_wrong.min(1)
-        pidxwrong = d_wrong.argmin(1)
-
-        d_correct = dist
-        d_correct[np.invert(label_equals_prototype)] = np.inf
-        distcorrect = d_correct.min(1)
-        pidxcorrect = d_correct.argmin(1)
+        prototypes = variables[:nb_prototypes]
+        stacked = self._stack_omegas(variables[nb_prototypes:])
+
+        _, distcorrect, distwrong, pidxcorrect, pidxwrong, projcorrect, \
+            projwrong = self._cached(
+                variables, training_data, lambda: self._local_winners(
+                    training_data, prototypes, stacked,
+                    label_equals_prototype))
 
         distcorrectpluswrong = distcorrect + distwrong
         distcorectminuswrong = distcorrect - distwrong
         mu = distcorectminuswrong / distcorrectpluswrong
-        mu = np.vectorize(self.phi_prime)(mu)
+        mu = self.phi_prime(mu)
 
-        g = np.zeros(variables.shape)
+        g = np.zeros_like(variables)
         normfactors = 4 / distcorrectpluswrong ** 2
 
-        if lr_relevances > 0:
-            gw = []
-            for i in range(len(psis)):
-                gw.append(np.zeros(psis[i].shape))
-        for i in range(nb_prototypes):
-            idxc = i == pidxcorrect
-            idxw = i == pidxwrong
-            if self.classwise:
-                right_idx = np.where((self.c_w_[i] == self.classes_) == 1)[0][
-                    0]  # test if works
-            else:
-                right_idx = i
-            dcd = mu[idxw] * distcorrect[idxw] * normfactors[idxw]
-            dwd = mu[idxc] * distwrong[idxc] * normfactors[idxc]
-
-            difc = training_data[idxc] - variables[i]
-            difw = training_data[idxw] - variables[i]
-            if lr_prototypes > 0:
-                g[i] = (dcd.dot(difw) - dwd.dot(difc)).dot(
-                    psis[right_idx].conj().T).dot(psis[right_idx])
-            if lr_relevances > 0:
-                gw[right_idx] -= (difw * dcd[np.newaxis].T).dot(psis[right_idx].conj().T).T.dot(difw) - \
-                                 (difc * dwd[np.newaxis].T).dot(psis[right_idx].conj().T).T.dot(difc)
-        if lr_relevances > 0:
-            if sum(self.regularization_) > 0:
-                regmatrices = np.zeros([sum(self.dim_), nb_features])
-                for i in range(len(psis)):
-                    regmatrices[sum(self.dim_[:i + 1]) - self.dim_[i]:sum(
-                        self.dim_[:i + 1])] = \
-                        self.regularization_[i] * np.linalg.pinv(psis[i])
-                g[nb_prototypes:] = 2 / nb_samples * lr_relevances * \
-                                    np.concatenate(gw) - regmatrices
-            else:
-                g[nb_prototypes:] = 2 / nb_samples * lr_relevances * \
-                                    np.concatenate(gw)
+        dcd = mu * distcorrect * normfactors
+        dwd = mu * distwrong * normfactors
         if lr_prototypes > 0:
-            g[:nb_prototypes] = 1 / nb_samples * \
-                                lr_prototypes * g[:nb_prototypes]
+            g[:nb_prototypes] = 1 / nb_samples * lr_prototypes * np.einsum(
+                'pdf,pd->pf', stacked, np.einsum(
+                    'pdf,pf->pd', stacked, _prototype_gradient(
+                        training_data, prototypes, pidxcorrect, pidxwrong,
+                        dcd, dwd)))
+        if lr_relevances > 0:
+            gw = _relevance_gradient(training_data, prototypes, projcorrect,
+                                     projwrong, pidxcorrect, pidxwrong,
+                                     dcd, dwd)
+            psis = self._split_omegas(variables[nb_prototypes:])
+            index = self._omega_index(len(psis))
+            offset = nb_prototypes
+            for i, psi in enumerate(psis):
+                dim = psi.shape[0]
+                gwi = -2 / nb_samples * lr_relevances * \
+                    gw[index == i].sum(0)[:dim]
+                if self.regularization_[i] > 0:
+                    gwi -= self.regularization_[i] * np.linalg.pinv(psi).T
+                g[offset:offset + dim] = gwi
+                offset += dim
         g = g * (1 + 0.0001 * random_state.rand(*g.shape) - 0.5)
         return g.ravel()
 
@@ -190,39 +275,55 @@ class LgmlvqModel(GlvqModel):
         nb_prototypes = self.c_w_.shape[0]
         variables = variables.reshape(variables.size // nb_features,
                                       nb_features)
-        # dim to indices
-        indices = []
-        for i in range(len(self.dim_)):
-            indices.append(sum(self.dim_[:i + 1]))
-        psis = np.split(variables[nb_prototypes:], indices[:-1])  # .conj().T
-
-        dist = self._compute_distance(training_data, variables[:nb_prototypes],
-                                      psis)  # change dist function ?
-        # dist = cdist(training_data, prototypes, 'sqeuclidean')
-        d_wrong = dist.copy()
-        d_wrong[label_equals_prototype] = np.inf
-        distwrong = d_wrong.min(1)
-        pidxwrong = d_wrong.argmin(1)
-
-        d_correct = dist
-        d_correct[np.invert(label_equals_prototype)] = np.inf
-        distcorrect = d_correct.min(1)
-        pidxcorrect = d_correct.argmin(1)
+        prototypes = variables[:nb_prototypes]
+        stacked = self._stack_omegas(variables[nb_prototypes:])
+
+        _, distcorrect, distwrong, _, pidxwrong, _, _ = self._cached(
+            variables, training_data, lambda: self._local_winners(
+                training_data, prototypes, stacked, label_equals_prototype))
 
         distcorrectpluswrong = distcorrect + distwrong
         distcorectminuswrong = distcorrect - distwrong
         mu = distcorectminuswrong / distcorrectpluswrong
-        mu *= self.c_[label_equals_prototype.argmax(1), d_wrong.argmin(1)]
+        mu *= self.c_[label_equals_prototype.argmax(1), pidxwrong]
 
         if sum(self.regularization_) > 0:
             def test(x):
                 return np.log(np.linalg.det(x.dot(x.conj().T)))
 
-            t = np.array([test(x) for x in psis])
+            t = np.array([test(x) for x in
+                          self._split_omegas(variables[nb_prototypes:])])
             reg_term = self.regularization_ * t
-            return np.vectorize(self.phi)(mu) - 1 / nb_samples * reg_term[
-                pidxcorrect] - 1 / nb_samples * reg_term[pidxwrong]
-        return np.vectorize(self.phi)(mu).sum(0)
+            return self.phi(mu).sum(0) - reg_term.sum()
+        return self.phi(mu).sum(0)
+
+    def _local_winners(self, training_data, prototypes, stacked,
+                       label_equals_prototype):
+        """_winners of the local distances, followed by the projected
+        differences psi_j (x_i - w_j) to the closest correct and the closest
+        wrong prototype. Only the projections of one block of samples to all
+        prototypes are held at a time, see _projection_blocks."""
+        nb_samples = training_data.shape[0]
+        nb_prototypes, dim = stacked.shape[:2]
+        dtype = np.result_type(training_data, stacked)
+        out = (np.empty((nb_samples, nb_prototypes), dtype=dtype),
+               np.empty(nb_samples, dtype=dtype),
+               np.empty(nb_samples, dtype=dtype),
+               np.empty(nb_samples, dtype=np.intp),
+               np.empty(nb_samples, dtype=np.intp),
+               np.empty((nb_samples, dim), dtype=dtype),
+               np.empty((nb_samples, dim), dtype=dtype))
+        for rows in _projection_blocks(nb_samples, stacked):
+            projected = _projected(training_data[rows], prototypes, stacked)
+            winners = _winners(
+                np.einsum('npd,npd->np', projected, projected),
+                label_equals_prototype[rows])
+            index = np.arange(projected.shape[0])
+            for part, value in zip(out, winners + (
+                    projected[index, winners[3]],
+                    projected[index, winners[4]])):
+                part[rows] = value
+        return out
 
     def _optimize(self, x, y, random_state):
         nb_prototypes, nb_features = self.w_.shape
@@ -251,30 +352,31 @@ class LgmlvqModel(GlvqModel):
                 raise ValueError("dim must be a list of positive ints")
 
         # initialize psis (psis is list of arrays)
-        if self.initial_matrices is None:
-            self.omegas_ = []
-            for d in self.dim_:
-                self.omegas_.append(
-                    random_state.rand(d, nb_features) * 2.0 - 1.0)
-        else:
-            if not isinstance(self.initial_matrices, list):
-                raise ValueError("initial matrices must be a list")
-            self.omegas_ = list(map(lambda v: validation.check_array(v),
-                                    self.initial_matrices))
-            if self.classwise and len(self.omegas_) != nb_classes:
-                raise ValueError("length of matrices wrong\n"
-                                 "found=%d\n"
-                                 "expected=%d" % (
-                                     len(self.omegas_), nb_classes))
-            elif len(self.omegas_) != nb_prototypes:
-                raise ValueError("length of matrices wrong\n"
-                                 "found=%d\n"
-                                 "expected=%d" % (
-                                     len(self.omegas_), nb_classes))
-            elif any(self.omegas_[i].shape != (self.dim_[i], nb_features)
-                     for i in range(len(self.omegas_))):
-                raise ValueError(
-                    "each matrix must have shape (%d,dim)" % nb_features)
+        if not self._warm_start():
+            if self.initial_matrices is None:
+                self.omegas_ = []
+                for d in self.dim_:
+                    self.omegas_.append(
+                        random_state.rand(d, nb_features) * 2.0 - 1.0)
+            else:
+                if not isinstance(self.initial_matrices, list):
+                    raise ValueError("initial matrices must be a list")
+                self.omegas_ = list(map(lambda v: validation.check_array(v),
+                                        self.initial_matrices))
+                if self.classwise and len(self.omegas_) != nb_classes:
+                    raise ValueError("length of matrices wrong\n"
+                                     "found=%d\n"
+                                     "expected=%d" % (
+                                         len(self.omegas_), nb_classes))
+                elif len(self.omegas_) != nb_prototypes:
+                    raise ValueError("length of matrices wrong\n"
+                                     "found=%d\n"
+                                     "expected=%d" % (
+                                         len(self.omegas_), nb_classes))
+                elif any(self.omegas_[i].shape != (self.dim_[i], nb_features)
+                         for i in range(len(self.omegas_))):
+                    raise ValueError(
+                        "each matrix must have shape (%d,dim)" % nb_features)
 
         if isinstance(self.regularization, float):
             if self.regularization < 0:
@@ -295,65 +397,42 @@ class LgmlvqModel(GlvqModel):
 
         variables = np.append(self.w_, np.concatenate(self.omegas_), axis=0)
         label_equals_prototype = y[np.newaxis].T == self.c_w_
-        res = minimize(
-            fun=lambda vs: self._f(
-                vs, x, label_equals_prototype=label_equals_prototype),
-            jac=lambda vs: self._g(
-                vs, x, label_equals_prototype=label_equals_prototype,
-                lr_prototypes=1, lr_relevances=0, random_state=random_state),
-            method='L-BFGS-B',
-            x0=variables, options={'disp': self.display, 'gtol': self.gtol,
-                                   'maxiter': self.max_iter})
+        res = self._minimize_phases(
+            fun=lambda vs, x, lep: self._f(
+                vs, x, label_equals_prototype=lep),
+            jac=lambda vs, x, lep, **lr: self._g(
+                vs, x, label_equals_prototype=lep,
+                random_state=random_state, **lr),
+            method='L-BFGS-B', x0=variables,
+            data=(x, label_equals_prototype),
+            random_state=random_state)
         n_iter = res.nit
-        res = minimize(
-            fun=lambda vs: self._f(
-                vs, x, label_equals_prototype=label_equals_prototype),
-            jac=lambda vs: self._g(
-                vs, x, label_equals_prototype=label_equals_prototype,
-                lr_prototypes=0, lr_relevances=1, random_state=random_state),
-            method='L-BFGS-B',
-            x0=res.x, options={'disp': self.display, 'gtol': self.gtol,
-                               'maxiter': self.max_iter})
-        n_iter = max(n_iter, res.nit)
-        res = minimize(
-            fun=lambda vs: self._f(
-                vs, x, label_equals_prototype=label_equals_prototype),
-            jac=lambda vs: self._g(
-                vs, x, label_equals_prototype=label_equals_prototype,
-                lr_prototypes=1, lr_relevances=1, random_state=random_state),
-            method='L-BFGS-B',
-            x0=res.x, options={'disp': self.display, 'gtol': self.gtol,
-                               'maxiter': self.max_iter})
-        n_iter = max(n_iter, res.nit)
         out = res.x.reshape(res.x.size // nb_features, nb_features)
         self.w_ = out[:nb_prototypes]
-        indices = []
-        for i in range(len(self.dim_)):
-            indices.append(sum(self.dim_[:i + 1]))
-        self.omegas_ = np.split(out[nb_prototypes:], indices[:-1])  # .conj().T
+        self.omegas_ = self._split_omegas(out[nb_prototypes:])
         self.n_iter_ = n_iter
 
+    def _squared_distance(self, x, w):
+        # the relevance distances of _compute_distance are squared already
+        return self._compute_distance(x, w)
+
     def _compute_distance(self, x, w=None, psis=None):
+        """Squared distances of all samples to all prototypes, each measured
+        with the local relevance matrix of the prototype.
+
+        psis is the tensor of _stack_omegas. The samples are projected block
+        by block, see _projection_blocks.
+        """
         if w is None:
             w = self.w_
         if psis is None:
-            psis = self.omegas_
-        nb_samples = x.shape[0]
-        if len(w.shape) is 1:
-            nb_prototypes = 1
-        else:
-            nb_prototypes = w.shape[0]
-        distance = np.zeros([nb_prototypes, nb_samples])
-        if len(psis) == nb_prototypes:
-            for i in range(nb_prototypes):
-                distance[i] = np.sum(np.dot(x - w[i], psis[i].conj().T) ** 2,
-                                     1)
-            return np.transpose(distance)
-        for i in range(nb_prototypes):
-            matrix_idx = np.where(self.classes_ == self.c_w_[i])[0][0]
-            distance[i] = np.sum(
-                np.dot(x - w[i], psis[matrix_idx].conj().T) ** 2, 1)
-        return np.transpose(distance)
+            psis = self._stack_omegas(np.concatenate(self.omegas_))
+        distance = np.empty((x.shape[0], w.shape[0]),
+                            dtype=np.result_type(x, psis))
+        for rows in _projection_blocks(x.shape[0], psis):
+            projected = _projected(x[rows], w, psis)
+            distance[rows] = np.einsum('npd,npd->np', projected, projected)
+        return distance
 
     def project(self, x, prototype_idx, dims, print_variance_covered=False):
         """Projects the data input data X using the relevance matrix of the
@@ -380,8 +459,8 @@ class LgmlvqModel(GlvqModel):
                 or self.prototypes_per_class != 1:
             print('project only possible with classwise relevance matrix')
         # y = self.predict(X)
-        v, u = np.linalg.eig(
-            self.omegas_[prototype_idx].T.dot(self.omegas_[prototype_idx]))
+        psi = self._stack_omegas(np.concatenate(self.omegas_))[prototype_idx]
+        v, u = np.linalg.eig(psi.T.dot(psi))
         idx = v.argsort()[::-1]
         if print_variance_covered:
             print('variance coverd by projection:',
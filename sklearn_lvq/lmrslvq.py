@@ -7,10 +7,9 @@
 from __future__ import division
 
 import numpy as np
-from scipy.optimize import minimize
 from sklearn.utils import validation
 
-from .rslvq import RslvqModel
+from .rslvq import RslvqModel, _softmax
 
 
 class LmrslvqModel(RslvqModel):
@@ -48,7 +47,8 @@ class LmrslvqModel(RslvqModel):
         Variance for the distribution.
 
     max_iter : int, optional (default=2500)
-        The maximum number of iterations.
+        The maximum number of iterations. For the stochastic solvers the
+        number of epochs.
 
     gtol : float, optional (default=1e-5)
         Gradient norm must be less than gtol before successful termination
@@ -63,6 +63,55 @@ class LmrslvqModel(RslvqModel):
         If None, the random number generator is the RandomState instance used
         by `np.random`.
 
+    solver : {'l-bfgs-b', 'sgd', 'adam'}, optional (default='l-bfgs-b')
+        Optimizer. 'l-bfgs-b' minimizes the cost on the whole training set,
+        'sgd' and 'adam' run mini-batch gradient descent for max_iter epochs.
+
+    batch_size : int, optional (default=256)
+        Size of the mini-batches of the stochastic solvers.
+
+    learning_rate : {'constant', 'invscaling'}, optional (default='constant')
+        Step size schedule of the stochastic solvers. 'invscaling' divides
+        learning_rate_init by the square root of the epoch number.
+
+    learning_rate_init : float, optional (default=0.01)
+        Initial step size of the stochastic solvers.
+
+    chunk_size : int or None, optional (default=None)
+        Number of samples for which cost and gradient, or the distances in
+        predict and decision_function, are evaluated at once. Bounds the
+        memory used for distances and gradient terms, so large (e.g.
+        memory-mapped) data sets can be processed. None evaluates cost and
+        gradient on all samples at once, and the distances in predict and
+        decision_function in blocks of at most 4096 samples.
+
+    dtype : {np.float32, np.float64}, optional (default=np.float64)
+        Floating point type of the data, the prototypes, the relevances and
+        all intermediate distances. np.float32 halves the memory traffic of
+        the distance computations at the cost of precision.
+
+    n_jobs : int or None, optional (default=None)
+        Number of threads predict and decision_function use to process the
+        blocks of samples in parallel, and number of processes for the
+        n_init fits. None means 1, -1 means all processors.
+
+    n_init : int, optional (default=1)
+        Number of fits from different random initializations. The model
+        with the lowest final cost is kept. The fits run in n_jobs
+        processes, which share the training data as memory maps.
+
+    phases : list or None, optional (default=None)
+        Optimization phases, each 'prototypes', 'relevances' or 'all' (the
+        parameters optimized), or a pair of such a name and the maximum
+        number of iterations of the phase. The phases share the max_iter
+        iterations. None optimizes the prototypes, the relevances and both
+        in turn, each phase with max_iter iterations.
+
+    max_time : float or None, optional (default=None)
+        Time limit in seconds for all phases together. The solver returns
+        the last iterate once it is exceeded and later phases are skipped.
+        None means no limit.
+
     Attributes
     ----------
 
@@ -92,16 +141,28 @@ class LmrslvqModel(RslvqModel):
     def __init__(self, prototypes_per_class=1, initial_prototypes=None,
                  initial_matrices=None, regularization=0.0, dim=None,
                  classwise=False, sigma=1, max_iter=2500, gtol=1e-5, display=False,
-                 random_state=None):
+                 random_state=None,
+                 solver='l-bfgs-b', batch_size=256, learning_rate='constant',
+                 learning_rate_init=0.01, chunk_size=None, dtype=np.float64,
+                 n_jobs=None, n_init=1,
+                 phases=None, max_time=None):
         super(LmrslvqModel, self).__init__(sigma=sigma,
                                            random_state=random_state,
                                            prototypes_per_class=prototypes_per_class,
                                            initial_prototypes=initial_prototypes,
-                                           gtol=gtol, display=display, max_iter=max_iter)
+                                           gtol=gtol, display=display, max_iter=max_iter,
+                                           solver=solver,
+                                           batch_size=batch_size,
+                                           learning_rate=learning_rate,
+                                           learning_rate_init=learning_rate_init,
+                                           chunk_size=chunk_size, dtype=dtype,
+                                           n_jobs=n_jobs, n_init=n_init)
         self.regularization = regularization
         self.initial_matrices = initial_matrices
         self.classwise = classwise
         self.initialdim = dim
+        self.phases = phases
+        self.max_time = max_time
 
     def _optgrad(self, variables, training_data, label_equals_prototype,
                  random_state, lr_relevances=0, lr_prototypes=1):
@@ -109,59 +170,40 @@ class LmrslvqModel(RslvqModel):
         nb_prototypes = self.c_w_.size
         variables = variables.reshape(variables.size // n_dim, n_dim)
         prototypes = variables[:nb_prototypes]
-        # dim to indices
-        indices = []
-        for i in range(len(self.dim_)):
-            indices.append(sum(self.dim_[:i + 1]))
-        omegas = np.split(variables[nb_prototypes:], indices[:-1])  # .conj().T
-
-        g = np.zeros(variables.shape)
-
-        if lr_relevances > 0:
-            gw = []
-            for i in range(len(omegas)):
-                gw.append(np.zeros(omegas[i].shape))
-        c = 1 / self.sigma
-        for i in range(n_data):
-            xi = training_data[i]
-            c_xi = label_equals_prototype[i]
-            for j in range(prototypes.shape[0]):
-                if len(omegas) == nb_prototypes:
-                    omega_index = j
-                else:
-                    omega_index = np.where(self.classes_ == self.c_w_[j])[0][0]
-                oo = omegas[omega_index].T.dot(omegas[omega_index])
-                d = (xi - prototypes[j])[np.newaxis].T
-                p = self._p(j, xi, prototypes=prototypes, omega=omegas[omega_index])
-                if self.c_w_[j] == c_xi:
-                    pj = self._p(j, xi, prototypes=prototypes, y=c_xi,
-                                 omega=omegas[omega_index])
-                if lr_prototypes > 0:
-                    if self.c_w_[j] == c_xi:
-                        g[j] += (c * (pj - p) * oo.dot(d)).ravel()
-                    else:
-                        g[j] -= (c * p * oo.dot(d)).ravel()
-                if lr_relevances > 0:
-                    if self.c_w_[j] == c_xi:
-                        gw -= (pj - p) / self.sigma * (
-                            omegas[omega_index].dot(d).dot(d.T))
-                    else:
-                        gw += p / self.sigma * (omegas[omega_index].dot(d).dot(d.T))
-        if lr_relevances > 0:
-            if sum(self.regularization_) > 0:
-                regmatrices = np.zeros([sum(self.dim_), n_dim])
-                for i in range(len(omegas)):
-                    regmatrices[sum(self.dim_[:i + 1]) - self.dim_[i]:sum(
-                        self.dim_[:i + 1])] = \
-                        self.regularization_[i] * np.linalg.pinv(omegas[i])
-                g[nb_prototypes:] = 2 / n_data * lr_relevances * \
-                                    np.concatenate(gw) - regmatrices
-            else:
-                g[nb_prototypes:] = 2 / n_data * lr_relevances * \
-                                    np.concatenate(gw)
+        omegas = self._split_omegas(variables[nb_prototypes:])
+        stacked = self._stack_omegas(variables[nb_prototypes:])
+
+        g = np.zeros_like(variables)
+
+        f, projected = self._cached(
+            variables, training_data,
+            lambda: self._costs(training_data, prototypes, stacked,
+                                return_projected=True))
+        same = label_equals_prototype[np.newaxis].T == self.c_w_
+        # coef[i, j] = (p_y(j|x_i) - p(j|x_i)) / sigma
+        coef = (same * _softmax(f, same) - _softmax(f)) / self.sigma
         if lr_prototypes > 0:
-            g[:nb_prototypes] = 1 / n_data * \
-                                lr_prototypes * g[:nb_prototypes]
+            # sum_i coef[i, j] omega_j^T omega_j (x_i - w_j)
+            diff = coef.T.dot(training_data) \
+                - coef.sum(0)[np.newaxis].T * prototypes
+            g[:nb_prototypes] = 1 / n_data * lr_prototypes * np.einsum(
+                'pdf,pd->pf', stacked, np.einsum('pdf,pf->pd', stacked, diff))
+        if lr_relevances > 0:
+            # sum_i coef[i, j] omega_j (x_i - w_j)(x_i - w_j)^T, for all
+            # prototypes j in one product with the projected differences
+            weighted = coef[:, :, np.newaxis] * projected
+            gw = weighted.reshape(n_data, -1).T.dot(training_data).reshape(
+                stacked.shape) - np.einsum('pd,pf->pdf', weighted.sum(0),
+                                           prototypes)
+            index = self._omega_index(len(omegas))
+            offset = nb_prototypes
+            for i, omega in enumerate(omegas):
+                dim = omega.shape[0]
+                gwi = -2 / n_data * lr_relevances * gw[index == i].sum(0)[:dim]
+                if self.regularization_[i] > 0:
+                    gwi -= self.regularization_[i] * np.linalg.pinv(omega).T
+                g[offset:offset + dim] = gwi
+                offset += dim
         g *= -(1 + 0.0001 * random_state.rand(*g.shape) - 0.5)
         return g.ravel()
 
@@ -170,29 +212,17 @@ class LmrslvqModel(RslvqModel):
         nb_prototypes = self.c_w_.size
         variables = variables.reshape(variables.size // n_dim, n_dim)
         prototypes = variables[:nb_prototypes]
-        indices = []
-        for i in range(len(self.dim_)):
-            indices.append(sum(self.dim_[:i + 1]))
-        omegas = np.split(variables[nb_prototypes:], indices[:-1])
-
-        out = 0
-        for i in range(n_data):
-            xi = training_data[i]
-            y = label_equals_prototype[i]
-            if len(omegas) == nb_prototypes:
-                fs = [self._costf(xi, prototypes[j], omega=omegas[j])
-                      for j in range(nb_prototypes)]
-            else:
-                fs = [self._costf(xi, prototypes[j], omega=omegas[np.where(self.classes_ == self.c_w_[j])[0][0]])
-                      for j in range(nb_prototypes)]
-            fs_max = max(fs)
-            s1 = sum([np.math.exp(fs[i] - fs_max) for i in range(len(fs))
-                      if self.c_w_[i] == y])
-            s2 = sum([np.math.exp(f - fs_max) for f in fs])
-            s1 += 0.0000001
-            s2 += 0.0000001
-            out += np.math.log(s1 / s2)
-        return -out
+        stacked = self._stack_omegas(variables[nb_prototypes:])
+
+        f, _ = self._cached(
+            variables, training_data,
+            lambda: self._costs(training_data, prototypes, stacked,
+                                return_projected=True))
+        same = label_equals_prototype[np.newaxis].T == self.c_w_
+        e = np.exp(f - f.max(1)[np.newaxis].T)
+        s1 = np.where(same, e, 0).sum(1) + 0.0000001
+        s2 = e.sum(1) + 0.0000001
+        return -np.log(s1 / s2).sum()
 
     def _optimize(self, x, y, random_state):
         nb_prototypes, nb_features = self.w_.shape
@@ -221,36 +251,37 @@ class LmrslvqModel(RslvqModel):
                 raise ValueError("dim must be a list of positive ints")
 
         # initialize psis (psis is list of arrays)
-        if self.initial_matrices is None:
-            self.omegas_ = []
-            for d in self.dim_:
-                self.omegas_.append(
-                    random_state.rand(d, nb_features) * 2.0 - 1.0)
-        else:
-            if not isinstance(self.initial_matrices, list):
-                raise ValueError("initial matrices must be a list")
-            self.omegas_ = list(map(lambda v: validation.check_array(v),
-                                    self.initial_matrices))
-            if self.classwise:
-                if len(self.omegas_) != nb_classes:
+        if not self._warm_start():
+            if self.initial_matrices is None:
+                self.omegas_ = []
+                for d in self.dim_:
+                    self.omegas_.append(
+                        random_state.rand(d, nb_features) * 2.0 - 1.0)
+            else:
+                if not isinstance(self.initial_matrices, list):
+                    raise ValueError("initial matrices must be a list")
+                self.omegas_ = list(map(lambda v: validation.check_array(v),
+                                        self.initial_matrices))
+                if self.classwise:
+                    if len(self.omegas_) != nb_classes:
+                        raise ValueError("length of matrices wrong\n"
+                                         "found=%d\n"
+                                         "expected=%d" % (
+                                             len(self.omegas_), nb_classes))
+                    elif np.sum(map(lambda v: v.shape[1],
+                                    self.omegas_)) != nb_features * \
+                            len(self.omegas_):
+                        raise ValueError(
+                            "each matrix should have %d columns" % nb_features)
+                elif len(self.omegas_) != nb_prototypes:
                     raise ValueError("length of matrices wrong\n"
                                      "found=%d\n"
                                      "expected=%d" % (
                                          len(self.omegas_), nb_classes))
-                elif np.sum(map(lambda v: v.shape[1],
-                                self.omegas_)) != nb_features * \
-                        len(self.omegas_):
+                elif np.sum([v.shape[1] for v in self.omegas_]) != \
+                        nb_features * len(self.omegas_):
                     raise ValueError(
                         "each matrix should have %d columns" % nb_features)
-            elif len(self.omegas_) != nb_prototypes:
-                raise ValueError("length of matrices wrong\n"
-                                 "found=%d\n"
-                                 "expected=%d" % (
-                                     len(self.omegas_), nb_classes))
-            elif np.sum([v.shape[1] for v in self.omegas_]) != \
-                    nb_features * len(self.omegas_):
-                raise ValueError(
-                    "each matrix should have %d columns" % nb_features)
 
         if isinstance(self.regularization, float):
             if self.regularization < 0:
@@ -271,42 +302,19 @@ class LmrslvqModel(RslvqModel):
 
         variables = np.append(self.w_, np.concatenate(self.omegas_), axis=0)
         label_equals_prototype = y
-        res = minimize(
-            fun=lambda vs: self._optfun(
-                vs, x, label_equals_prototype=label_equals_prototype),
-            jac=lambda vs: self._optgrad(
-                vs, x, label_equals_prototype=label_equals_prototype,
-                lr_prototypes=0, lr_relevances=1, random_state=random_state),
-            method='L-BFGS-B',
-            x0=variables, options={'disp': self.display, 'gtol': self.gtol,
-                                   'maxiter': self.max_iter})
+        res = self._minimize_phases(
+            fun=lambda vs, x, lep: self._optfun(
+                vs, x, label_equals_prototype=lep),
+            jac=lambda vs, x, lep, **lr: self._optgrad(
+                vs, x, label_equals_prototype=lep,
+                random_state=random_state, **lr),
+            method='L-BFGS-B', x0=variables,
+            data=(x, label_equals_prototype),
+            random_state=random_state)
         n_iter = res.nit
-        res = minimize(
-            fun=lambda vs: self._optfun(
-                vs, x, label_equals_prototype=label_equals_prototype),
-            jac=lambda vs: self._optgrad(
-                vs, x, label_equals_prototype=label_equals_prototype,
-                lr_prototypes=0, lr_relevances=1, random_state=random_state),
-            method='L-BFGS-B',
-            x0=res.x, options={'disp': self.display, 'gtol': self.gtol,
-                               'maxiter': self.max_iter})
-        n_iter = max(n_iter, res.nit)
-        res = minimize(
-            fun=lambda vs: self._optfun(
-                vs, x, label_equals_prototype=label_equals_prototype),
-            jac=lambda vs: self._optgrad(
-                vs, x, label_equals_prototype=label_equals_prototype,
-                lr_prototypes=1, lr_relevances=1, random_state=random_state),
-            method='L-BFGS-B',
-            x0=res.x, options={'disp': self.display, 'gtol': self.gtol,
-                               'maxiter': self.max_iter})
-        n_iter = max(n_iter, res.nit)
         out = res.x.reshape(res.x.size // nb_features, nb_features)
         self.w_ = out[:nb_prototypes]
-        indices = []
-        for i in range(len(self.dim_)):
-            indices.append(sum(self.dim_[:i + 1]))
-        self.omegas_ = np.split(out[nb_prototypes:], indices[:-1])  # .conj().T
+        self.omegas_ = self._split_omegas(out[nb_prototypes:])
         self.n_iter_ = n_iter
 
     def _f(self, x, i):
@@ -314,11 +322,30 @@ class LmrslvqModel(RslvqModel):
         d = d.T.dot(self.omegas_[i].T).dot(self.omegas_[i]).dot(d)
         return -d / (2 * self.sigma)
 
+    def _costs(self, x, w, stacked=None, return_projected=False):
+        """Matrix of the costs _costf of all samples and prototypes.
+
+        With return_projected the differences omega_j (x_i - w_j) of shape
+        [n_samples, n_prototypes, max(dim_)] are returned as well.
+        """
+        if stacked is None:
+            stacked = self._stack_omegas(np.concatenate(self.omegas_))
+        nb_prototypes, dim, n_dim = stacked.shape
+        projected = x.dot(stacked.reshape(-1, n_dim).T).reshape(
+            x.shape[0], nb_prototypes, dim)
+        projected -= np.einsum('pdf,pf->pd', stacked, w)
+        f = np.einsum('npd,npd->np', projected, projected)
+        f /= -2 * self.sigma
+        if return_projected:
+            return f, projected
+        return f
+
     def _costf(self, x, w, **kwargs):
         if 'omega' in kwargs:
             omega = kwargs['omega']
         else:
-            omega = self.omegas_[np.where(self.w_ == w)[0][0]]
+            j = np.where((self.w_ == w).all(1))[0][0]
+            omega = self.omegas_[self._omega_index(len(self.omegas_))[j]]
         d = (x - w)[np.newaxis].T
         d = d.T.dot(omega.T).dot(omega).dot(d)
         return -d / (2 * self.sigma)
@@ -326,13 +353,7 @@ class LmrslvqModel(RslvqModel):
     def _compute_distance(self, x, w=None):
         if w is None:
             w = self.w_
-
-        def foo(e):
-            fun = np.vectorize(lambda w: self._costf(e, w),
-                               signature='(n)->()')
-            return fun(w)
-
-        return np.vectorize(foo, signature='(n)->()')(x)
+        return self._costs(x, w)
 
     def project(self, x, prototype_idx, dims, print_variance_covered=False):
         """Projects the data input data X using the relevance matrix of the
@@ -359,8 +380,9 @@ class LmrslvqModel(RslvqModel):
                 or self.prototypes_per_class != 1:
             print('project only possible with classwise relevance matrix')
         # y = self.predict(X)
-        v, u = np.linalg.eig(
-            self.omegas_[prototype_idx].T.dot(self.omegas_[prototype_idx]))
+        omega = self._stack_omegas(
+            np.concatenate(self.omegas_))[prototype_idx]
+        v, u = np.linalg.eig(omega.T.dot(omega))
         idx = v.argsort()[::-1]
         if print_variance_covered:
             print('variance coverd by projection:',
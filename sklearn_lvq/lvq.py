@@ -1,22 +1,65 @@
+from __future__ import division
+
+import copy
+import functools
+import time
+
 import numpy as np
+from joblib import Parallel, delayed, effective_n_jobs
+from scipy.optimize import OptimizeResult, minimize
 
 from sklearn.base import BaseEstimator, ClassifierMixin
 from sklearn.utils import validation
 from sklearn.utils.multiclass import unique_labels
+from sklearn.utils.validation import check_is_fitted
+
+
+_PHASES = {'prototypes': (1, 0), 'relevances': (0, 1), 'all': (1, 1)}
+
+# largest block of samples predict and the like evaluate at once without
+# chunk_size
+_PREDICT_CHUNK_SIZE = 4096
+
+
+class _TimeLimitReached(Exception):
+    """Raised from the l-bfgs-b callback once max_time has passed."""
+
+
+def _fit_single(model, random_state, fit, x, y, *args):
+    """Fit a copy of model with the given seed, one of the n_init fits.
+    fit is the name of the fitting method, which takes x, y and args."""
+    model = copy.copy(model)
+    model.random_state = random_state
+    model.n_init = 1
+    return getattr(model, fit)(x, y, *args)
 
 
 class _LvqBaseModel(BaseEstimator, ClassifierMixin):
 
+    # shift of the training samples while _optimize_centered runs
+    _shift = None
+
     def __init__(self, prototypes_per_class=1, initial_prototypes=None,
-                 max_iter=2500, gtol=1e-5, display=False, random_state=None):
+                 max_iter=2500, gtol=1e-5, display=False, random_state=None,
+                 solver='l-bfgs-b', batch_size=256, learning_rate='constant',
+                 learning_rate_init=0.01, chunk_size=None, dtype=np.float64,
+                 n_jobs=None, n_init=1):
         self.random_state = random_state
         self.initial_prototypes = initial_prototypes
         self.prototypes_per_class = prototypes_per_class
         self.display = display
         self.max_iter = max_iter
         self.gtol = gtol
+        self.solver = solver
+        self.batch_size = batch_size
+        self.learning_rate = learning_rate
+        self.learning_rate_init = learning_rate_init
+        self.chunk_size = chunk_size
+        self.dtype = dtype
+        self.n_jobs = n_jobs
+        self.n_init = n_init
 
-    def _validate_train_parms(self, train_set, train_lab):
+    def _validate_train_parms(self, train_set, train_lab, classes=None):
         random_state = validation.check_random_state(self.random_state)
         if not isinstance(self.display, bool):
             raise ValueError("display must be a boolean")
@@ -24,9 +67,33 @@ class _LvqBaseModel(BaseEstimator, ClassifierMixin):
             raise ValueError("max_iter must be an positive integer")
         if not isinstance(self.gtol, float) or self.gtol <= 0:
             raise ValueError("gtol must be a positive float")
-        train_set, train_lab = validation.check_X_y(train_set, train_lab)
+        if self.solver not in ('l-bfgs-b', 'sgd', 'adam'):
+            raise ValueError("solver must be one of 'l-bfgs-b', 'sgd', 'adam'")
+        if not isinstance(self.batch_size, int) or self.batch_size < 1:
+            raise ValueError("batch_size must be a positive integer")
+        if self.learning_rate not in ('constant', 'invscaling'):
+            raise ValueError(
+                "learning_rate must be one of 'constant', 'invscaling'")
+        if not isinstance(self.learning_rate_init, float) or \
+                self.learning_rate_init <= 0:
+            raise ValueError("learning_rate_init must be a positive float")
+        if self.chunk_size is not None and (
+                not isinstance(self.chunk_size, int) or self.chunk_size < 1):
+            raise ValueError("chunk_size must be a positive integer or None")
+        if self.dtype not in (np.float32, np.float64):
+            raise ValueError("dtype must be np.float32 or np.float64")
+        if not isinstance(self.n_init, int) or self.n_init < 1:
+            raise ValueError("n_init must be a positive integer")
+        train_set, train_lab = validation.check_X_y(train_set, train_lab,
+                                                    dtype=self.dtype)
 
-        self.classes_ = unique_labels(train_lab)
+        if classes is None:
+            self.classes_ = unique_labels(train_lab)
+        else:
+            self.classes_ = unique_labels(classes)
+            if not np.isin(train_lab, self.classes_).all():
+                raise ValueError("y contains classes not in classes\n"
+                                 "classes={}\n".format(self.classes_))
         nb_classes = len(self.classes_)
         nb_samples, nb_features = train_set.shape  # nb_samples unused
 
@@ -52,20 +119,25 @@ class _LvqBaseModel(BaseEstimator, ClassifierMixin):
                     "length=%d" % (nb_classes, nb_ppc.size))
         # initialize prototypes
         if self.initial_prototypes is None:
-            self.w_ = np.empty([np.sum(nb_ppc), nb_features], dtype=np.double)
+            self.w_ = np.empty([np.sum(nb_ppc), nb_features],
+                               dtype=self.dtype)
             self.c_w_ = np.empty([nb_ppc.sum()], dtype=self.classes_.dtype)
             pos = 0
             for actClass in range(nb_classes):
                 nb_prot = nb_ppc[actClass]
-                mean = np.mean(
-                    train_set[train_lab == self.classes_[actClass], :], 0)
+                mask = train_lab == self.classes_[actClass]
+                if not mask.any():
+                    # a class given to partial_fit, but missing in its
+                    # first batch, starts at the mean of the batch
+                    mask = np.ones_like(mask)
+                mean = self._class_mean(train_set, mask)
                 self.w_[pos:pos + nb_prot] = mean + (
                         random_state.rand(nb_prot, nb_features) * 2 - 1)
                 self.c_w_[pos:pos + nb_prot] = self.classes_[actClass]
                 pos += nb_prot
         else:
             x = validation.check_array(self.initial_prototypes)
-            self.w_ = x[:, :-1]
+            self.w_ = x[:, :-1].astype(self.dtype)
             self.c_w_ = x[:, -1]
             if self.w_.shape != (np.sum(nb_ppc), nb_features):
                 raise ValueError("the initial prototypes have wrong shape\n"
@@ -97,13 +169,466 @@ class _LvqBaseModel(BaseEstimator, ClassifierMixin):
         --------
         self
         """
+        self._partial = None
+        if isinstance(self.n_init, int) and self.n_init > 1:
+            return self._fit_n_init('fit', x, y)
         x, y, random_state = self._validate_train_parms(x, y)
         if len(np.unique(y)) == 1:
             raise ValueError("fitting " + type(
                 self).__name__ + " with only one class is not possible")
-        self._optimize(x, y, random_state)
+        self._optimize_centered(x, y, random_state)
+        self._cache = None
         return self
 
+    def _fit_n_init(self, fit, x, y, *args):
+        # validate once up front, so the workers get the data as arrays
+        # which joblib hands over as shared memory maps
+        x, y = validation.check_X_y(x, y, dtype=self.dtype)
+        random_state = validation.check_random_state(self.random_state)
+        seeds = random_state.randint(np.iinfo(np.int32).max,
+                                     size=self.n_init)
+        models = Parallel(n_jobs=self.n_jobs)(
+            delayed(_fit_single)(self, seed, fit, x, y, *args)
+            for seed in seeds)
+        best = min(models, key=lambda model: model._cost)
+        self.__dict__.update((key, value)
+                             for key, value in vars(best).items()
+                             if key.endswith('_'))
+        self._cost = best._cost
+        self._cache = None
+        return self
+
+    def partial_fit(self, x, y, classes=None):
+        """Update the LVQ model with one epoch of stochastic gradient descent
+        over the given batch.
+
+        The first call initializes the model like fit and fixes the set of
+        classes, later calls continue from the current prototypes (and
+        relevances). The batches are processed with 'adam' if solver='adam'
+        and with 'sgd' otherwise.
+
+        Parameters
+        ----------
+        x : array-like, shape = [n_samples, n_features]
+          Training vector, where n_samples in the number of samples and
+          n_features is the number of features.
+        y : array, shape = [n_samples]
+          Target values (integers in classification, real numbers in
+          regression)
+        classes : array, shape = [n_classes], optional
+          All classes of the stream. Needed in the first call if its batch
+          does not hold every class, ignored in later calls if equal to
+          classes_. Without it the first batch fixes the classes.
+
+        Returns
+        --------
+        self
+        """
+        x, y, random_state = self._validate_partial_fit(x, y, classes)
+        self._optimize_centered(x, y, random_state)
+        self._partial['n_calls'] += 1
+        self._cache = None
+        return self
+
+    def _validate_partial_fit(self, x, y, classes=None):
+        if not self._warm_start():
+            x, y, random_state = self._validate_train_parms(x, y, classes)
+            if len(self.classes_) == 1:
+                raise ValueError("fitting " + type(
+                    self).__name__ + " with only one class is not possible")
+            self._partial = {'n_calls': 0, 'random_state': random_state,
+                             'states': []}
+        else:
+            if classes is not None and not np.array_equal(
+                    unique_labels(classes), self.classes_):
+                raise ValueError(
+                    "classes differ from the classes of the first call to "
+                    "partial_fit\n"
+                    "classes={}\n".format(self.classes_))
+            x, y = validation.check_X_y(x, y, dtype=self.w_.dtype)
+            if x.shape[1] != self.w_.shape[1]:
+                raise ValueError("X has wrong number of features\n"
+                                 "found=%d\n"
+                                 "expected=%d" % (self.w_.shape[1],
+                                                  x.shape[1]))
+            if not np.isin(y, self.classes_).all():
+                raise ValueError(
+                    "y contains classes not seen in the first call to "
+                    "partial_fit\n"
+                    "classes={}\n".format(self.classes_))
+        self._partial['phase'] = 0
+        return x, y, self._partial['random_state']
+
+    def _warm_start(self):
+        """Whether _optimize continues from the parameters of a previous
+        partial_fit call instead of initializing them."""
+        partial = getattr(self, '_partial', None)
+        return partial is not None and partial['n_calls'] > 0
+
+    def _phase_schedule(self):
+        """Validate phases and max_time and return the optimization phases
+        as a list of (lr_prototypes, lr_relevances, max_iter) triples.
+
+        Without phases the prototypes, the relevances and both are
+        optimized in turn, each with max_iter iterations. Given phases
+        share max_iter: a phase runs at most for its own iteration count
+        and at most for the iterations the previous phases left over.
+        Consecutive equal phases are merged into one solver run, which
+        keeps the l-bfgs-b history.
+        """
+        if self.max_time is not None and (
+                not isinstance(self.max_time, (int, float)) or
+                self.max_time <= 0):
+            raise ValueError("max_time must be a positive number or None")
+        if self.phases is None:
+            return [_PHASES[name] + (self.max_iter,)
+                    for name in ('prototypes', 'relevances', 'all')]
+        phases = list(self.phases)
+        if len(phases) == 0:
+            raise ValueError("phases must not be empty")
+        schedule = []
+        for phase in phases:
+            if isinstance(phase, (tuple, list)):
+                name, nb_iter = phase
+            else:
+                name, nb_iter = phase, self.max_iter
+            if name not in _PHASES:
+                raise ValueError(
+                    "phases must contain 'prototypes', 'relevances' or "
+                    "'all', optionally paired with a number of iterations")
+            if not isinstance(nb_iter, int) or nb_iter < 1:
+                raise ValueError(
+                    "number of iterations of a phase must be a positive "
+                    "integer")
+            if schedule and schedule[-1][:2] == _PHASES[name]:
+                schedule[-1] = _PHASES[name] + (schedule[-1][2] + nb_iter,)
+            else:
+                schedule.append(_PHASES[name] + (nb_iter,))
+        return schedule
+
+    def _minimize_phases(self, fun, jac, x0, data, random_state,
+                         method='l-bfgs-b'):
+        """Minimize fun in the phases of _phase_schedule.
+
+        jac is called as ``jac(variables, *data, lr_prototypes=...,
+        lr_relevances=...)``. Phases which would start after max_time
+        seconds are skipped. Returns the result of the last phase run,
+        with nit the largest number of iterations of a phase.
+        """
+        schedule = self._phase_schedule()
+        deadline = None
+        if self.max_time is not None:
+            deadline = time.time() + self.max_time
+        budget = None
+        if self.phases is not None:
+            budget = self.max_iter
+        res = None
+        n_iter = 0
+        for lr_prototypes, lr_relevances, nb_iter in schedule:
+            if budget is not None:
+                nb_iter = min(nb_iter, budget)
+            if res is not None and (budget == 0 or (
+                    deadline is not None and time.time() >= deadline)):
+                break
+            res = self._minimize(fun, functools.partial(
+                jac, lr_prototypes=lr_prototypes, lr_relevances=lr_relevances),
+                                 x0 if res is None else res.x, data,
+                                 random_state, method=method,
+                                 max_iter=nb_iter, deadline=deadline)
+            n_iter = max(n_iter, res.nit)
+            if budget is not None:
+                budget -= res.nit
+        res.nit = n_iter
+        return res
+
+    def _minimize(self, fun, jac, x0, data, random_state,
+                  method='l-bfgs-b', max_iter=None, deadline=None):
+        """Minimize fun starting from x0 with the configured solver.
+
+        fun and jac are called as ``fun(variables, *data)``, where data is a
+        tuple of arrays sharing the first (sample) axis. The stochastic
+        solvers call jac on mini-batches of these arrays. max_iter overrides
+        the max_iter of the model, after the time.time() deadline the
+        solver stops and returns the last iterate. Returns a
+        scipy.optimize.OptimizeResult.
+        """
+        if max_iter is None:
+            max_iter = self.max_iter
+        partial = getattr(self, '_partial', None)
+        if partial is not None:
+            # partial_fit: one epoch, continuing the solver state that
+            # belongs to this optimization phase
+            if partial['phase'] == len(partial['states']):
+                partial['states'].append({})
+            state = partial['states'][partial['phase']]
+            partial['phase'] += 1
+            return self._stochastic_minimize(fun, jac, x0, data,
+                                             random_state, state, 1)
+        if self.solver != 'l-bfgs-b':
+            res = self._stochastic_minimize(fun, jac, x0, data,
+                                            random_state, {}, max_iter,
+                                            deadline)
+            self._cost = res.fun
+            return res
+        # scipy iterates in double precision, the model functions are
+        # evaluated in the dtype of the model
+        dtype = self.w_.dtype
+
+        def fun_and_jac(vs):
+            f, g = self._accumulate(fun, jac, vs.astype(dtype, copy=False),
+                                    data)
+            return f, g.astype(np.double, copy=False)
+
+        if self.chunk_size is not None or self._shift is not None:
+            kwargs = {'fun': fun_and_jac, 'jac': True}
+        else:
+            kwargs = {
+                'fun': lambda vs: fun(vs.astype(dtype, copy=False), *data),
+                'jac': lambda vs: jac(vs.astype(dtype, copy=False),
+                                      *data).astype(np.double, copy=False)}
+        iterates = [np.asarray(x0, dtype=np.double).ravel(), 0]
+        if deadline is not None:
+            def callback(xk):
+                iterates[:] = [np.copy(xk), iterates[1] + 1]
+                if time.time() >= deadline:
+                    raise _TimeLimitReached()
+            kwargs['callback'] = callback
+        try:
+            res = minimize(method=method, x0=x0,
+                           options={'disp': self.display, 'gtol': self.gtol,
+                                    'maxiter': max_iter}, **kwargs)
+        except _TimeLimitReached:
+            res = OptimizeResult(
+                x=iterates[0], nit=iterates[1], success=False,
+                message='max_time reached',
+                fun=self._accumulate(fun, None,
+                                     iterates[0].astype(dtype), data))
+        res.x = res.x.astype(dtype, copy=False)
+        self._cost = res.fun
+        return res
+
+    def _stochastic_minimize(self, fun, jac, x0, data, random_state, state,
+                             nb_epochs, deadline=None):
+        variables = np.array(x0, dtype=self.w_.dtype).ravel()
+        nb_samples = data[0].shape[0]
+        batch_size = min(self.batch_size, nb_samples)
+        # adam moment estimates, kept in state across partial_fit calls
+        beta1, beta2, epsilon = 0.9, 0.999, 1e-8
+        m = state.get('m', np.zeros_like(variables))
+        v = state.get('v', np.zeros_like(variables))
+        t = state.get('t', 0)
+        first_epoch = epoch = state.get('epoch', 0)
+        while epoch < first_epoch + nb_epochs and (
+                deadline is None or time.time() < deadline):
+            eta = self.learning_rate_init
+            if self.learning_rate == 'invscaling':
+                eta /= np.sqrt(epoch + 1)
+            order = random_state.permutation(nb_samples)
+            for start in range(0, nb_samples, batch_size):
+                idx = np.sort(order[start:start + batch_size])
+                g = jac(variables,
+                        *self._shifted([d[idx] for d in data])).astype(
+                    variables.dtype, copy=False)
+                if self.solver == 'adam':
+                    t += 1
+                    m = beta1 * m + (1 - beta1) * g
+                    v = beta2 * v + (1 - beta2) * g ** 2
+                    m_hat = m / (1 - beta1 ** t)
+                    v_hat = v / (1 - beta2 ** t)
+                    variables = variables - eta * m_hat / (
+                            np.sqrt(v_hat) + epsilon)
+                else:
+                    variables = variables - eta * g
+            if self.display:
+                print('epoch %d: cost %f' % (
+                    epoch + 1, self._accumulate(fun, None, variables, data)))
+            epoch += 1
+        state.update(m=m, v=v, t=t, epoch=epoch)
+        return OptimizeResult(
+            x=variables, nit=epoch - first_epoch, success=True,
+            fun=self._accumulate(fun, None, variables, data))
+
+    def _chunks(self, nb_samples, nb_blocks=1, max_size=None):
+        """Row slices of at most chunk_size samples covering nb_samples,
+        without chunk_size nb_blocks slices of equal size, but of at most
+        max_size samples."""
+        step = self.chunk_size
+        if step is None:
+            step = max(-(-nb_samples // nb_blocks), 1)
+            if max_size is not None:
+                step = min(step, max_size)
+        return [slice(start, start + step)
+                for start in range(0, nb_samples, step)]
+
+    def _accumulate(self, fun, jac, variables, data):
+        """Evaluate fun (and jac) at variables chunk by chunk over data.
+
+        The cost is a sum over the samples and the gradient a mean, so the
+        gradients of the chunks are weighted by their share of the samples.
+        The sample independent part of the cost (the regularization term),
+        i.e. the cost of an empty chunk, is only counted once.
+        """
+        nb_samples = data[0].shape[0]
+        chunks = self._chunks(nb_samples)
+        f = 0
+        if len(chunks) > 1:
+            f -= (len(chunks) - 1) * fun(variables, *[d[:0] for d in data])
+        g = 0
+        for rows in chunks:
+            chunk = self._shifted([d[rows] for d in data])
+            f += fun(variables, *chunk)
+            if jac is not None:
+                g = g + chunk[0].shape[0] / nb_samples * jac(variables,
+                                                             *chunk)
+        if jac is None:
+            return f
+        return f, g
+
+    def _origin(self):
+        """Mean of the prototypes of float32 models, None for float64.
+
+        The distance kernels compute |x|^2 + |w|^2 - 2xw, which cancels badly
+        in single precision for points far from the origin. All models only
+        depend on the differences x - w, so data and prototypes are moved by
+        this shift once per chunk, mini-batch or predict block instead of in
+        every distance computation.
+        """
+        if self.w_.dtype != np.float32:
+            return None
+        return self.w_.mean(0)
+
+    def _centered(self, x):
+        """x and the prototypes moved by _origin, e.g. for a predict
+        block."""
+        shift = self._origin()
+        if shift is None:
+            return x, self.w_
+        return x - shift, self.w_ - shift
+
+    def _optimize_centered(self, x, *args):
+        """_optimize with the prototypes moved by _origin. The solvers move
+        the samples of every chunk or mini-batch alike, see _shifted, and
+        the fitted prototypes are moved back afterwards."""
+        shift = self._origin()
+        if shift is None:
+            return self._optimize(x, *args)
+        self.w_ = self.w_ - shift
+        self._shift = shift
+        try:
+            self._optimize(x, *args)
+        finally:
+            self._shift = None
+            self.w_ = self.w_ + shift
+
+    def _shifted(self, data):
+        """data, a list of arrays sharing the sample axis, with the training
+        samples in its first array moved by the shift of
+        _optimize_centered. Only this chunk is copied, not the training
+        set."""
+        if self._shift is None:
+            return data
+        return [data[0] - self._shift] + data[1:]
+
+    def _check_x(self, x):
+        """Validate the input of predict and the like against the model."""
+        check_is_fitted(self, ['w_', 'c_w_'])
+        x = validation.check_array(x, dtype=self.w_.dtype)
+        if x.shape[1] != self.w_.shape[1]:
+            raise ValueError("X has wrong number of features\n"
+                             "found=%d\n"
+                             "expected=%d" % (self.w_.shape[1], x.shape[1]))
+        return x
+
+    def _blockwise(self, x, fun):
+        """Apply fun to blocks of at most chunk_size rows of x, or of
+        _PREDICT_CHUNK_SIZE rows without chunk_size, and write the results
+        into one output array. Only one block of distances per thread is
+        held in memory; n_jobs threads process the blocks, numpy releases the
+        GIL in the distance computations."""
+        n_jobs = effective_n_jobs(self.n_jobs)
+        chunks = self._chunks(x.shape[0], n_jobs, _PREDICT_CHUNK_SIZE)
+        if len(chunks) == 1:
+            return fun(x)
+        # the result of one row gives shape and dtype of the output, so all
+        # blocks run in parallel
+        probe = fun(x[:1])
+        out = np.empty((x.shape[0],) + probe.shape[1:], dtype=probe.dtype)
+
+        def block(rows):
+            out[rows] = fun(x[rows])
+
+        Parallel(n_jobs=n_jobs, backend='threading')(
+            delayed(block)(rows) for rows in chunks)
+        return out
+
+    def _class_mean(self, x, mask):
+        """Mean of the rows of x selected by mask, read chunk by chunk."""
+        total = 0
+        for rows in self._chunks(x.shape[0]):
+            total = total + x[rows][mask[rows]].sum(0)
+        return total / mask.sum()
+
+    def _cached(self, variables, training_data, compute):
+        """Evaluate ``compute()`` once per parameter vector and data set.
+
+        l-bfgs-b requests the cost and the gradient at the same point in two
+        separate calls, which both need the same distance matrix and winners.
+        """
+        key = variables.tobytes()
+        cache = getattr(self, '_cache', None)
+        if cache is None or cache[0] is not training_data or cache[1] != key:
+            # release the previous evaluation before computing the next one
+            cache = self._cache = None
+            cache = (training_data, key, compute())
+            self._cache = cache
+        return cache[2]
+
+    def _model_cached(self, compute, *arrays):
+        """Evaluate ``compute()`` once per state of the fitted arrays.
+
+        Keeps e.g. the rescaled prototypes of a trained model for all
+        subsequent predict calls.
+        """
+        key = b''.join(a.tobytes() for a in arrays)
+        cache = getattr(self, '_model_cache', None)
+        if cache is None or cache[0] != key:
+            cache = (key, compute())
+            self._model_cache = cache
+        return cache[1]
+
+    def _split_omegas(self, variables):
+        """Split the rows of the local relevance matrices, stacked one below
+        the other, into a list with one matrix per entry of dim_."""
+        return np.split(variables, np.cumsum(self.dim_)[:-1])
+
+    def _omega_index(self, nb_matrices):
+        """Index of the local relevance matrix of each prototype."""
+        if nb_matrices == self.c_w_.size:
+            return np.arange(nb_matrices)
+        return np.searchsorted(self.classes_, self.c_w_)
+
+    def _stack_omegas(self, variables):
+        """Local relevance matrix of each prototype as one tensor.
+
+        variables holds the rows of all matrices one below the other. Returns
+        an array of shape [n_prototypes, max(dim_), n_features], matrices of
+        lower rank are padded with zero rows, which do not change the
+        distances. With one matrix per prototype of equal rank the result is
+        a view of variables.
+        """
+        nb_matrices = len(self.dim_)
+        dim = max(self.dim_)
+        if min(self.dim_) == dim:
+            stacked = variables.reshape(nb_matrices, dim, variables.shape[1])
+        else:
+            stacked = np.zeros([nb_matrices, dim, variables.shape[1]],
+                               dtype=variables.dtype)
+            for i, omega in enumerate(self._split_omegas(variables)):
+                stacked[i, :omega.shape[0]] = omega
+        if nb_matrices == self.c_w_.size:
+            return stacked
+        return stacked[self._omega_index(nb_matrices)]
+
     def project(self, x, dims, print_variance_covered=False):
         """Projects the data input data X using the relevance matrix of trained
         model to dimension dim
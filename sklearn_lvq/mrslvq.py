@@ -7,9 +7,9 @@
 from __future__ import division
 
 import numpy as np
-from scipy.optimize import minimize
 from sklearn.utils import validation
-from .rslvq import RslvqModel
+from .glvq import _squared_euclidean
+from .rslvq import RslvqModel, _softmax
 
 
 class MrslvqModel(RslvqModel):
@@ -44,7 +44,8 @@ class MrslvqModel(RslvqModel):
         Variance for the distribution.
 
     max_iter : int, optional (default=500)
-        The maximum number of iterations.
+        The maximum number of iterations. For the stochastic solvers the
+        number of epochs.
 
     gtol : float, optional (default=1e-5)
         Gradient norm must be less than gtol before successful
@@ -59,6 +60,55 @@ class MrslvqModel(RslvqModel):
         If None, the random number generator is the RandomState instance used
         by `np.random`.
 
+    solver : {'l-bfgs-b', 'sgd', 'adam'}, optional (default='l-bfgs-b')
+        Optimizer. 'l-bfgs-b' minimizes the cost on the whole training set,
+        'sgd' and 'adam' run mini-batch gradient descent for max_iter epochs.
+
+    batch_size : int, optional (default=256)
+        Size of the mini-batches of the stochastic solvers.
+
+    learning_rate : {'constant', 'invscaling'}, optional (default='constant')
+        Step size schedule of the stochastic solvers. 'invscaling' divides
+        learning_rate_init by the square root of the epoch number.
+
+    learning_rate_init : float, optional (default=0.01)
+        Initial step size of the stochastic solvers.
+
+    chunk_size : int or None, optional (default=None)
+        Number of samples for which cost and gradient, or the distances in
+        predict and decision_function, are evaluated at once. Bounds the
+        memory used for distances and gradient terms, so large (e.g.
+        memory-mapped) data sets can be processed. None evaluates cost and
+        gradient on all samples at once, and the distances in predict and
+        decision_function in blocks of at most 4096 samples.
+
+    dtype : {np.float32, np.float64}, optional (default=np.float64)
+        Floating point type of the data, the prototypes, the relevances and
+        all intermediate distances. np.float32 halves the memory traffic of
+        the distance computations at the cost of precision.
+
+    n_jobs : int or None, optional (default=None)
+        Number of threads predict and decision_function use to process the
+        blocks of samples in parallel, and number of processes for the
+        n_init fits. None means 1, -1 means all processors.
+
+    n_init : int, optional (default=1)
+        Number of fits from different random initializations. The model
+        with the lowest final cost is kept. The fits run in n_jobs
+        processes, which share the training data as memory maps.
+
+    phases : list or None, optional (default=None)
+        Optimization phases, each 'prototypes', 'relevances' or 'all' (the
+        parameters optimized), or a pair of such a name and the maximum
+        number of iterations of the phase. The phases share the max_iter
+        iterations. None optimizes the prototypes, the relevances and both
+        in turn, each phase with max_iter iterations.
+
+    max_time : float or None, optional (default=None)
+        Time limit in seconds for all phases together. The solver returns
+        the last iterate once it is exceeded and later phases are skipped.
+        None means no limit.
+
     Attributes
     ----------
 
@@ -85,15 +135,26 @@ class MrslvqModel(RslvqModel):
 
     def __init__(self, prototypes_per_class=1, initial_prototypes=None,
                  initial_matrix=None, regularization=0.0, dim=None,
-                 sigma=1, max_iter=1000, gtol=1e-5, display=False, random_state=None):
+                 sigma=1, max_iter=1000, gtol=1e-5, display=False, random_state=None,
+                 solver='l-bfgs-b', batch_size=256, learning_rate='constant',
+                 learning_rate_init=0.01, chunk_size=None, dtype=np.float64,
+                 n_jobs=None, n_init=1,
+                 phases=None, max_time=None):
         super(MrslvqModel, self).__init__(sigma=sigma,
                                           random_state=random_state,
                                           prototypes_per_class=prototypes_per_class,
                                           initial_prototypes=initial_prototypes,
-                                          gtol=gtol, display=display, max_iter=max_iter)
+                                          gtol=gtol, display=display, max_iter=max_iter,
+                                          solver=solver, batch_size=batch_size,
+                                          learning_rate=learning_rate,
+                                          learning_rate_init=learning_rate_init,
+                                          chunk_size=chunk_size, dtype=dtype,
+                                          n_jobs=n_jobs, n_init=n_init)
         self.regularization = regularization
         self.initial_matrix = initial_matrix
         self.initialdim = dim
+        self.phases = phases
+        self.max_time = max_time
 
     def _optgrad(self, variables, training_data, label_equals_prototype,
                  random_state, lr_relevances=0, lr_prototypes=1):
@@ -103,40 +164,35 @@ class MrslvqModel(RslvqModel):
         prototypes = variables[:nb_prototypes]
         omega = variables[nb_prototypes:]
 
-        g = np.zeros(variables.shape)
+        g = np.zeros_like(variables)
 
+        f = self._cached(variables, training_data,
+                         lambda: self._costs(training_data, prototypes,
+                                             omega=omega))
+        same = label_equals_prototype[np.newaxis].T == self.c_w_
+        # coef[i, j] = (p_y(j|x_i) - p(j|x_i)) / sigma
+        coef = (same * _softmax(f, same) - _softmax(f)) / self.sigma
+        coef_w = coef.sum(0)
+        if lr_prototypes > 0:
+            # sum_i coef[i, j] (x_i - w_j)
+            g[:nb_prototypes] = coef.T.dot(training_data) \
+                - coef_w[np.newaxis].T * prototypes
         if lr_relevances > 0:
-            gw = np.zeros([omega.shape[0], n_dim])
-
-        oo = omega.T.dot(omega)
-        c = 1 / self.sigma
-        for i in range(n_data):
-            xi = training_data[i]
-            c_xi = label_equals_prototype[i]
-            for j in range(prototypes.shape[0]):
-                d = (xi - prototypes[j])[np.newaxis].T
-                p = self._p(j, xi, prototypes=prototypes, omega=omega)
-                if self.c_w_[j] == c_xi:
-                    pj = self._p(j, xi, prototypes=prototypes, y=c_xi, omega=omega)
-                if lr_prototypes > 0:
-                    if self.c_w_[j] == c_xi:
-                        g[j] += (c * (pj - p) * oo.dot(d)).ravel()
-                    else:
-                        g[j] -= (c * p * oo.dot(d)).ravel()
-                if lr_relevances > 0:
-                    if self.c_w_[j] == c_xi:
-                        gw -= (pj - p) / self.sigma * (omega.dot(d).dot(d.T))
-                    else:
-                        gw += p / self.sigma * (omega.dot(d).dot(d.T))
-        f3 = 0
-        if self.regularization:
-            f3 = np.linalg.pinv(omega).conj().T
-        if lr_relevances > 0:
+            # sum_ij coef[i, j] (x_i - w_j)(x_i - w_j)^T as one weighted Gram
+            # product instead of n_data * nb_prototypes outer products
+            cross = training_data.T.dot(coef).dot(prototypes)
+            gram = (training_data.T * coef.sum(1)).dot(training_data) \
+                - cross - cross.T + (prototypes.T * coef_w).dot(prototypes)
+            gw = -omega.dot(gram)
+            f3 = 0
+            if self.regularization:
+                f3 = np.linalg.pinv(omega).conj().T
             g[nb_prototypes:] = 2 / n_data \
                                 * lr_relevances * gw - self.regularization * f3
         if lr_prototypes > 0:
+            oo = omega.T.dot(omega)
             g[:nb_prototypes] = 1 / n_data * lr_prototypes \
-                                * g[:nb_prototypes].dot(omega.T.dot(omega))
+                                * g[:nb_prototypes].dot(oo).dot(oo)
         g *= -(1 + 0.0001 * random_state.rand(*g.shape) - 0.5)
         return g.ravel()
 
@@ -147,23 +203,14 @@ class MrslvqModel(RslvqModel):
         prototypes = variables[:nb_prototypes]
         omega = variables[nb_prototypes:]
 
-        out = 0
-        for i in range(n_data):
-            xi = training_data[i]
-            y = label_equals_prototype[i]
-            fs = [self._costf(xi, w, omega=omega) for w in
-                  prototypes]
-            # fs = []
-            # for w in prototypes:
-            #     fs.append(self.costf(xi,w,self.sigma,omega=omega))
-            fs_max = max(fs)
-            s1 = sum([np.math.exp(fs[i] - fs_max) for i in range(len(fs))
-                      if self.c_w_[i] == y])
-            s2 = sum([np.math.exp(f - fs_max) for f in fs])
-            s1 += 0.0000001
-            s2 += 0.0000001
-            out += np.math.log(s1 / s2)
-        return -out
+        f = self._cached(variables, training_data,
+                         lambda: self._costs(training_data, prototypes,
+                                             omega=omega))
+        same = label_equals_prototype[np.newaxis].T == self.c_w_
+        e = np.exp(f - f.max(1)[np.newaxis].T)
+        s1 = np.where(same, e, 0).sum(1) + 0.0000001
+        s2 = e.sum(1) + 0.0000001
+        return -np.log(s1 / s2).sum()
 
     def _optimize(self, x, y, random_state):
         if not isinstance(self.regularization,
@@ -177,56 +224,35 @@ class MrslvqModel(RslvqModel):
         else:
             self.dim_ = self.initialdim
 
-        if self.initial_matrix is None:
-            if self.dim_ == nb_features:
-                self.omega_ = np.eye(nb_features)
+        if not self._warm_start():
+            if self.initial_matrix is None:
+                if self.dim_ == nb_features:
+                    self.omega_ = np.eye(nb_features)
+                else:
+                    self.omega_ = random_state.rand(
+                        self.dim_, nb_features) * 2 - 1
             else:
-                self.omega_ = random_state.rand(self.dim_, nb_features) * 2 - 1
-        else:
-            self.omega_ = validation.check_array(self.initial_matrix)
-            if self.omega_.shape[1] != nb_features:
-                raise ValueError(
-                    "initial matrix has wrong number of features\n"
-                    "found=%d\n"
-                    "expected=%d" % (self.omega_.shape[1], nb_features))
+                self.omega_ = validation.check_array(self.initial_matrix)
+                if self.omega_.shape[1] != nb_features:
+                    raise ValueError(
+                        "initial matrix has wrong number of features\n"
+                        "found=%d\n"
+                        "expected=%d" % (self.omega_.shape[1], nb_features))
 
         variables = np.append(self.w_, self.omega_, axis=0)
         label_equals_prototype = y
         method = 'l-bfgs-b'
         method = 'bfgs'
-        res = minimize(
-            fun=lambda vs:
-            self._optfun(vs, x, label_equals_prototype=y),
-            jac=lambda vs:
-            self._optgrad(vs, x, label_equals_prototype=y,
-                          random_state=random_state,
-                          lr_prototypes=1, lr_relevances=0),
+        res = self._minimize_phases(
+            fun=lambda vs, x, lep: self._optfun(
+                vs, x, label_equals_prototype=lep),
+            jac=lambda vs, x, lep, **lr: self._optgrad(
+                vs, x, label_equals_prototype=lep,
+                random_state=random_state, **lr),
             method=method, x0=variables,
-            options={'disp': self.display, 'gtol': self.gtol,
-                     'maxiter': self.max_iter})
+            data=(x, label_equals_prototype),
+            random_state=random_state)
         n_iter = res.nit
-        res = minimize(
-            fun=lambda vs:
-            self._optfun(vs, x, label_equals_prototype=label_equals_prototype),
-            jac=lambda vs:
-            self._optgrad(vs, x, label_equals_prototype=label_equals_prototype,
-                          random_state=random_state,
-                          lr_prototypes=0, lr_relevances=1),
-            method=method, x0=res.x,
-            options={'disp': self.display, 'gtol': self.gtol,
-                     'maxiter': self.max_iter})
-        n_iter = max(n_iter, res.nit)
-        res = minimize(
-            fun=lambda vs:
-            self._optfun(vs, x, label_equals_prototype=label_equals_prototype),
-            jac=lambda vs:
-            self._optgrad(vs, x, label_equals_prototype=label_equals_prototype,
-                          random_state=random_state,
-                          lr_prototypes=1, lr_relevances=1),
-            method=method, x0=res.x,
-            options={'disp': self.display, 'gtol': self.gtol,
-                     'maxiter': self.max_iter})
-        n_iter = max(n_iter, res.nit)
         out = res.x.reshape(res.x.size // nb_features, nb_features)
         self.w_ = out[:nb_prototypes]
         self.omega_ = out[nb_prototypes:]
@@ -234,6 +260,13 @@ class MrslvqModel(RslvqModel):
             np.sum(np.diag(self.omega_.T.dot(self.omega_))))
         self.n_iter_ = n_iter
 
+    def _costs(self, x, w, omega=None):
+        """Matrix of the costs _costf of all samples and prototypes."""
+        if omega is None:
+            omega = self.omega_
+        return _squared_euclidean(x.dot(omega.T), w.dot(omega.T)) \
+            / (-2 * self.sigma)
+
     def _costf(self, x, w, **kwargs):
         if 'omega' in kwargs:
             omega = kwargs['omega']
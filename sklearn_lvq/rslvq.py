@@ -6,15 +6,20 @@
 
 from __future__ import division
 
-import math
 import numpy as np
-from scipy.optimize import minimize
-from sklearn.utils import validation
 from sklearn.utils.multiclass import unique_labels
-from sklearn.utils.validation import check_is_fitted
+from sklearn_lvq.glvq import _squared_euclidean
 from sklearn_lvq.lvq import _LvqBaseModel
 
 
+def _softmax(f, mask=None):
+    """Row-wise softmax of f, only over the entries where mask is True."""
+    if mask is not None:
+        f = np.where(mask, f, -np.inf)
+    e = np.exp(f - f.max(1)[np.newaxis].T)
+    return e / e.sum(1)[np.newaxis].T
+
+
 # TODO: add sigma for every prototype
 
 
@@ -37,7 +42,8 @@ class RslvqModel(_LvqBaseModel):
         Variance for the distribution.
 
     max_iter : int, optional (default=2500)
-        The maximum number of iterations.
+        The maximum number of iterations. For the stochastic solvers the
+        number of epochs.
 
     gtol : float, optional (default=1e-5)
         Gradient norm must be less than gtol before successful termination
@@ -52,6 +58,43 @@ class RslvqModel(_LvqBaseModel):
         If None, the random number generator is the RandomState instance used
         by `np.random`.
 
+    solver : {'l-bfgs-b', 'sgd', 'adam'}, optional (default='l-bfgs-b')
+        Optimizer. 'l-bfgs-b' minimizes the cost on the whole training set,
+        'sgd' and 'adam' run mini-batch gradient descent for max_iter epochs.
+
+    batch_size : int, optional (default=256)
+        Size of the mini-batches of the stochastic solvers.
+
+    learning_rate : {'constant', 'invscaling'}, optional (default='constant')
+        Step size schedule of the stochastic solvers. 'invscaling' divides
+        learning_rate_init by the square root of the epoch number.
+
+    learning_rate_init : float, optional (default=0.01)
+        Initial step size of the stochastic solvers.
+
+    chunk_size : int or None, optional (default=None)
+        Number of samples for which cost and gradient, or the distances in
+        predict and decision_function, are evaluated at once. Bounds the
+        memory used for distances and gradient terms, so large (e.g.
+        memory-mapped) data sets can be processed. None evaluates cost and
+        gradient on all samples at once, and the distances in predict and
+        decision_function in blocks of at most 4096 samples.
+
+    dtype : {np.float32, np.float64}, optional (default=np.float64)
+        Floating point type of the data, the prototypes, the relevances and
+        all intermediate distances. np.float32 halves the memory traffic of
+        the distance computations at the cost of precision.
+
+    n_jobs : int or None, optional (default=None)
+        Number of threads predict and decision_function use to process the
+        blocks of samples in parallel, and number of processes for the
+        n_init fits. None means 1, -1 means all processors.
+
+    n_init : int, optional (default=1)
+        Number of fits from different random initializations. The model
+        with the lowest final cost is kept. The fits run in n_jobs
+        processes, which share the training data as memory maps.
+
     Attributes
     ----------
 
@@ -72,11 +115,19 @@ class RslvqModel(_LvqBaseModel):
 
     def __init__(self, prototypes_per_class=1, initial_prototypes=None,
                  sigma=0.5, max_iter=2500, gtol=1e-5,
-                 display=False, random_state=None):
+                 display=False, random_state=None,
+                 solver='l-bfgs-b', batch_size=256, learning_rate='constant',
+                 learning_rate_init=0.01, chunk_size=None, dtype=np.float64,
+                 n_jobs=None, n_init=1):
         super(RslvqModel,self).__init__(prototypes_per_class=prototypes_per_class,
                                         initial_prototypes=initial_prototypes,
                                         max_iter=max_iter, gtol=gtol, display=display,
-                                        random_state=random_state)
+                                        random_state=random_state,
+                                        solver=solver, batch_size=batch_size,
+                                        learning_rate=learning_rate,
+                                        learning_rate_init=learning_rate_init,
+                                        chunk_size=chunk_size, dtype=dtype,
+                                        n_jobs=n_jobs, n_init=n_init)
         self.sigma = sigma
 
     def _optgrad(self, variables, training_data, label_equals_prototype,
@@ -85,18 +136,12 @@ class RslvqModel(_LvqBaseModel):
         nb_prototypes = self.c_w_.size
         prototypes = variables.reshape(nb_prototypes, n_dim)
 
-        g = np.zeros(prototypes.shape)
-        for i in range(n_data):
-            xi = training_data[i]
-            c_xi = label_equals_prototype[i]
-            for j in range(prototypes.shape[0]):
-                d = (xi - prototypes[j])
-                c = 1 / self.sigma
-                if self.c_w_[j] == c_xi:
-                    g[j] += c * (self._p(j, xi, prototypes=prototypes, y=c_xi) -
-                                 self._p(j, xi, prototypes=prototypes)) * d
-                else:
-                    g[j] -= c * self._p(j, xi, prototypes=prototypes) * d
+        f = self._cached(variables, training_data,
+                         lambda: self._costs(training_data, prototypes))
+        same = label_equals_prototype[np.newaxis].T == self.c_w_
+        # d cost / d w_j = sum_i (p_y(j|x_i) - p(j|x_i)) (x_i - w_j) / sigma
+        coef = (same * _softmax(f, same) - _softmax(f)) / self.sigma
+        g = coef.T.dot(training_data) - coef.sum(0)[np.newaxis].T * prototypes
         g /= n_data
         g *= -(1 + 0.0001 * random_state.rand(*g.shape) - 0.5)
         return g.ravel()
@@ -106,37 +151,34 @@ class RslvqModel(_LvqBaseModel):
         nb_prototypes = self.c_w_.size
         prototypes = variables.reshape(nb_prototypes, n_dim)
 
-        out = 0
-
-        for i in range(n_data):
-            xi = training_data[i]
-            y = label_equals_prototype[i]
-            fs = [self._costf(xi, w) for w in prototypes]
-            fs_max = max(fs)
-            s1 = sum([np.math.exp(fs[i] - fs_max) for i in range(len(fs))
-                      if self.c_w_[i] == y])
-            s2 = sum([np.math.exp(f - fs_max) for f in fs])
-            s1 += 0.0000001
-            s2 += 0.0000001
-            out += math.log(s1 / s2)
-        return -out
+        f = self._cached(variables, training_data,
+                         lambda: self._costs(training_data, prototypes))
+        same = label_equals_prototype[np.newaxis].T == self.c_w_
+        e = np.exp(f - f.max(1)[np.newaxis].T)
+        s1 = np.where(same, e, 0).sum(1) + 0.0000001
+        s2 = e.sum(1) + 0.0000001
+        return -np.log(s1 / s2).sum()
 
     def _optimize(self, x, y, random_state):
         label_equals_prototype = y
-        res = minimize(
-            fun=lambda vs: self._optfun(
+        res = self._minimize(
+            fun=lambda vs, x, lep: self._optfun(
                 variables=vs, training_data=x,
-                label_equals_prototype=label_equals_prototype),
-            jac=lambda vs: self._optgrad(
+                label_equals_prototype=lep),
+            jac=lambda vs, x, lep: self._optgrad(
                 variables=vs, training_data=x,
-                label_equals_prototype=label_equals_prototype,
+                label_equals_prototype=lep,
                 random_state=random_state),
             method='l-bfgs-b', x0=self.w_,
-            options={'disp': False, 'gtol': self.gtol,
-                     'maxiter': self.max_iter})
+            data=(x, label_equals_prototype),
+            random_state=random_state)
         self.w_ = res.x.reshape(self.w_.shape)
         self.n_iter_ = res.nit
 
+    def _costs(self, x, w):
+        """Matrix of the costs _costf of all samples and prototypes."""
+        return _squared_euclidean(x, w) / (-2 * self.sigma)
+
     def _costf(self, x, w, **kwargs):
         d = (x - w)[np.newaxis].T
         d = d.T.dot(d)
@@ -174,18 +216,53 @@ class RslvqModel(_LvqBaseModel):
         C : array, shape = (n_samples,)
             Returns predicted values.
         """
-        check_is_fitted(self, ['w_', 'c_w_'])
-        x = validation.check_array(x)
-        if x.shape[1] != self.w_.shape[1]:
-            raise ValueError("X has wrong number of features\n"
-                             "found=%d\n"
-                             "expected=%d" % (self.w_.shape[1], x.shape[1]))
+        x = self._check_x(x)
+        return self._blockwise(
+            x, lambda block: self.c_w_[
+                self._costs(*self._centered(block)).argmax(1)])
 
-        def foo(e):
-            fun = np.vectorize(lambda w: self._costf(e, w),
-                               signature='(n)->()')
-            pred = fun(self.w_).argmax()
-            return self.c_w_[pred]
+    def predict_proba(self, x):
+        """Class posterior probabilities for each input sample.
 
-        return np.vectorize(foo, signature='(n)->()')(x)
+        The posterior of a class is the sum of the soft assignments
+        p(j|x) of its prototypes, i.e. the softmax of _costf.
 
+        Parameters
+        ----------
+        x : array-like, shape = [n_samples, n_features]
+
+        Returns
+        -------
+        proba : array, shape = (n_samples, n_classes)
+            Probabilities of the classes in the order of classes_.
+        """
+        x = self._check_x(x)
+        return self._blockwise(x, self._proba_block)
+
+    def predict_log_proba(self, x):
+        """Logarithm of the class posterior probabilities.
+
+        Parameters
+        ----------
+        x : array-like, shape = [n_samples, n_features]
+
+        Returns
+        -------
+        log_proba : array, shape = (n_samples, n_classes)
+            Log-probabilities of the classes in the order of classes_.
+        """
+        x = self._check_x(x)
+        return self._blockwise(
+            x, lambda block: self._proba_block(block, log=True))
+
+    def _proba_block(self, x, log=False):
+        f = self._costs(*self._centered(x))
+        f -= f.max(1)[np.newaxis].T
+        e = np.exp(f)
+        total = e.sum(1)[np.newaxis].T
+        # sum the prototypes of each class
+        e = e.dot(self.c_w_[np.newaxis].T == self.classes_)
+        if not log:
+            return e / total
+        with np.errstate(divide='ignore'):
+            return np.log(e) - np.log(total)
@@ -0,0 +1,32 @@
+import warnings
+
+import numpy as np
+
+from sklearn.utils.testing import assert_allclose
+
+from ..activations import sigmoid, sigmoid_and_prime, sigmoid_prime
+
+
+def test_sigmoid_large_arguments():
+    x = np.array([-1e308, -1000., -50., 0., 50., 1000., 1e308])
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        for beta in [1, 2, 100]:
+            y = sigmoid(x, beta)
+            dy = sigmoid_prime(x, beta)
+            y2, dy2 = sigmoid_and_prime(x, beta)
+            assert not np.any(np.isnan(y)) and not np.any(np.isnan(dy))
+            assert_allclose(y[[0, 1, 3, 5, 6]], [0, 0, 0.5, 1, 1])
+            assert_allclose(dy[[0, 1, 3, 5, 6]], [0, 0, beta / 4, 0, 0])
+            assert_allclose(y2, y)
+            assert_allclose(dy2, dy)
+            assert np.all((y >= 0) & (y <= 1)) and np.all(dy >= 0)
+
+
+def test_sigmoid_prime():
+    x = np.linspace(-5, 5, 11)
+    eps = 1e-6
+    for beta in [1, 2]:
+        assert_allclose(sigmoid_prime(x, beta),
+                        (sigmoid(x + eps, beta) - sigmoid(x - eps, beta))
+                        / (2 * eps), rtol=1e-6)
@@ -5,6 +5,8 @@ from .. import GrlvqModel
 from .. import GmlvqModel
 from .. import GrmlvqModel
 from .. import LgmlvqModel
+from .. import lgmlvq
+from .. import lvq
 from sklearn.utils.testing import assert_greater, assert_raise_message, \
     assert_allclose
 
@@ -219,4 +221,292 @@ def test_lgmlvq_iris():
                         dim=[1, 1])
     x = np.array([[0, 0], [0, 4], [1, 4], [1, 8]])
     y = np.array([1, 1, 2, 2])
-    model.fit(x, y)
\ No newline at end of file
+    model.fit(x, y)
+
+
+def test_glvq_stochastic_solvers():
+    for solver in ['sgd', 'adam']:
+        model = GlvqModel(solver=solver, batch_size=32, max_iter=100,
+                          learning_rate_init=0.2, random_state=0)
+        model.fit(iris.data, iris.target)
+        assert_greater(model.score(iris.data, iris.target), score)
+    model = GmlvqModel(solver='adam', batch_size=32, max_iter=50,
+                       learning_rate='invscaling', random_state=0)
+    model.fit(iris.data, iris.target)
+    assert_greater(model.score(iris.data, iris.target), score)
+
+    assert_raise_message(ValueError, 'solver must be one of',
+                         GlvqModel(solver='newton').fit, iris.data,
+                         iris.target)
+    assert_raise_message(ValueError, 'batch_size must be a positive integer',
+                         GlvqModel(batch_size=0).fit, iris.data, iris.target)
+    assert_raise_message(ValueError, 'learning_rate must be one of',
+                         GlvqModel(learning_rate='adaptive').fit, iris.data,
+                         iris.target)
+    assert_raise_message(ValueError,
+                         'learning_rate_init must be a positive float',
+                         GlvqModel(learning_rate_init=-0.1).fit, iris.data,
+                         iris.target)
+
+
+def test_glvq_partial_fit():
+    for model in [GlvqModel(solver='adam', batch_size=16, random_state=0),
+                  GmlvqModel(solver='adam', batch_size=16, random_state=0)]:
+        for epoch in range(10):
+            for start in range(0, iris.target.size, 50):
+                model.partial_fit(iris.data[start:start + 50],
+                                  iris.target[start:start + 50])
+        assert_greater(model.score(iris.data, iris.target), score)
+
+    assert_raise_message(ValueError, 'y contains classes not seen',
+                         model.partial_fit, iris.data, iris.target + 3)
+    assert_raise_message(ValueError, 'X has wrong number of features',
+                         model.partial_fit, [[1, 2], [3, 4]], [0, 1])
+    assert_raise_message(ValueError, 'classes differ from the classes',
+                         model.partial_fit, iris.data, iris.target, [0, 1])
+
+    # a stream whose first batch misses a class, or holds only one
+    for first in [iris.target < 2, iris.target == 0]:
+        model = GlvqModel(solver='adam', batch_size=16,
+                          learning_rate_init=0.05, random_state=0)
+        model.partial_fit(iris.data[first], iris.target[first],
+                          classes=[0, 1, 2])
+        assert_allclose(model.classes_, [0, 1, 2])
+        for epoch in range(30):
+            model.partial_fit(iris.data, iris.target, classes=[0, 1, 2])
+        assert_greater(model.score(iris.data, iris.target), score)
+    assert_raise_message(ValueError, 'y contains classes not in classes',
+                         GlvqModel().partial_fit, iris.data, iris.target,
+                         [0, 1])
+
+
+def test_glvq_chunked():
+    for model in [GlvqModel(chunk_size=40), GmlvqModel(chunk_size=40),
+                  LgmlvqModel(chunk_size=40, regularization=0.1)]:
+        model.fit(iris.data, iris.target)
+        assert_greater(model.score(iris.data, iris.target), score)
+
+    assert_raise_message(ValueError,
+                         'chunk_size must be a positive integer or None',
+                         GlvqModel(chunk_size=0).fit, iris.data, iris.target)
+
+
+def test_glvq_float32():
+    for model in [GlvqModel(dtype=np.float32),
+                  GmlvqModel(dtype=np.float32)]:
+        model.fit(iris.data, iris.target)
+        assert_greater(model.score(iris.data, iris.target), score)
+        assert model.w_.dtype == np.float32
+    assert model.omega_.dtype == np.float32
+    # single precision distances of data far from the origin
+    # the samples are moved per chunk and mini-batch
+    far = iris.data + 10000
+    for model in [GlvqModel(dtype=np.float32),
+                  GlvqModel(dtype=np.float32, chunk_size=40),
+                  GlvqModel(dtype=np.float32, solver='adam', batch_size=32,
+                            max_iter=100, learning_rate_init=0.2,
+                            random_state=0)]:
+        model.fit(far, iris.target)
+        assert_greater(model.score(far, iris.target), score)
+        assert_greater(model.w_.min(), 10000)
+
+    assert_raise_message(ValueError, 'dtype must be np.float32 or np.float64',
+                         GlvqModel(dtype=np.int32).fit, iris.data,
+                         iris.target)
+
+
+def test_glvq_decision_function():
+    model = GmlvqModel(prototypes_per_class=2, random_state=0)
+    model.fit(iris.data, iris.target)
+    scores = model.decision_function(iris.data)
+    assert scores.shape == (iris.target.size, 3)
+    assert_allclose(model.classes_[scores.argmax(1)],
+                    model.predict(iris.data))
+    model.chunk_size = 7
+    assert_allclose(model.decision_function(iris.data), scores)
+    # without chunk_size the blocks are bounded as well
+    model.chunk_size = None
+    block = lvq._PREDICT_CHUNK_SIZE
+    lvq._PREDICT_CHUNK_SIZE = 16
+    try:
+        assert len(model._chunks(iris.target.size, 1,
+                                 lvq._PREDICT_CHUNK_SIZE)) == 10
+        assert_allclose(model.decision_function(iris.data), scores)
+    finally:
+        lvq._PREDICT_CHUNK_SIZE = block
+
+    binary = iris.target > 0
+    model = GlvqModel().fit(iris.data, binary)
+    scores = model.decision_function(iris.data)
+    assert scores.shape == (iris.target.size,)
+    assert_allclose(scores > 0, model.predict(iris.data))
+    assert_raise_message(ValueError, 'X has wrong number of features',
+                         model.decision_function, [[1, 2], [3, 4]])
+
+
+def test_glvq_predict_n_jobs():
+    model = GlvqModel(prototypes_per_class=2, random_state=0)
+    model.fit(iris.data, iris.target)
+    pred = model.predict(iris.data)
+    scores = model.decision_function(iris.data)
+    for chunk_size in [None, 16]:
+        model.n_jobs = 2
+        model.chunk_size = chunk_size
+        assert_allclose(model.predict(iris.data), pred)
+        assert_allclose(model.decision_function(iris.data), scores)
+
+
+def test_glvq_n_init():
+    seeds = check_random_state(0).randint(np.iinfo(np.int32).max, size=3)
+    costs = [GlvqModel(prototypes_per_class=2, random_state=seed).fit(
+        iris.data, iris.target)._cost for seed in seeds]
+    model = GlvqModel(prototypes_per_class=2, n_init=3, n_jobs=2,
+                      random_state=0)
+    model.fit(iris.data, iris.target)
+    assert_greater(model.score(iris.data, iris.target), score)
+    assert_allclose(model._cost, min(costs))
+    assert model.n_init == 3
+    assert model.random_state == 0
+
+    assert_raise_message(ValueError, 'n_init must be a positive integer',
+                         GlvqModel(n_init=0).fit, iris.data, iris.target)
+
+
+def test_lgmlvq_local_ranks():
+    model = LgmlvqModel(dim=[1, 2, 4], random_state=0)
+    model.fit(iris.data, iris.target)
+    assert [omega.shape for omega in model.omegas_] == \
+        [(1, 4), (2, 4), (4, 4)]
+    assert_greater(model.score(iris.data, iris.target), score)
+    dist = model._compute_distance(iris.data)
+    for j, omega in enumerate(model.omegas_):
+        d = iris.data - model.w_[j]
+        assert_allclose(dist[:, j], (d.dot(omega.T) ** 2).sum(1))
+    # the samples are projected in blocks of bounded size
+    block = lgmlvq._PROJECTION_BLOCK
+    lgmlvq._PROJECTION_BLOCK = 16
+    try:
+        assert_allclose(model._compute_distance(iris.data), dist)
+    finally:
+        lgmlvq._PROJECTION_BLOCK = block
+
+
+def test_gmlvq_low_rank():
+    model = GmlvqModel(dim=2, random_state=0)
+    model.fit(iris.data, iris.target)
+    assert model.omega_.shape == (2, 4)
+    assert_greater(model.score(iris.data, iris.target), score)
+    dist = model._compute_distance(iris.data)
+    for j, w in enumerate(model.w_):
+        assert_allclose(dist[:, j],
+                        ((iris.data - w).dot(model.omega_.T) ** 2).sum(1),
+                        atol=1e-10)
+
+
+def test_grlvq_scaled_distance():
+    model = GrlvqModel(random_state=0)
+    model.fit(iris.data, iris.target)
+    for j, w in enumerate(model.w_):
+        assert_allclose(model._compute_distance(iris.data)[:, j],
+                        ((iris.data - w) ** 2 * model.lambda_).sum(1),
+                        atol=1e-10)
+    # predict keeps the rescaled prototypes for all blocks and calls
+    model._model_cache = None
+    model.chunk_size = 40
+    predicted = model.predict(iris.data)
+    scaled = model._model_cache[1]
+    assert_allclose(scaled, model.w_ * np.sqrt(model.lambda_))
+    model.decision_function(iris.data)
+    assert model._model_cache[1] is scaled
+    # and follows changes of the model
+    model.lambda_ = model.lambda_[::-1].copy()
+    assert_allclose(model._compute_distance(iris.data)[:, 0],
+                    ((iris.data - model.w_[0]) ** 2 *
+                     model.lambda_).sum(1), atol=1e-10)
+    assert model._model_cache[1] is not scaled
+    model.lambda_ = model.lambda_[::-1].copy()
+    assert (model.predict(iris.data) == predicted).all()
+
+    model = GrmlvqModel(random_state=0)
+    model.fit(iris.data, iris.target)
+    model._model_cache = None
+    model.predict(iris.data)
+    projected = model._model_cache[1]
+    assert_allclose(projected, (model.w_ * model.lambda_).dot(model.omega_.T))
+    model.decision_function(iris.data)
+    assert model._model_cache[1] is projected
+
+
+def test_gmlvq_phases():
+    model = GmlvqModel(phases=[('prototypes', 5), 'all'], max_iter=50,
+                       random_state=0)
+    model.fit(iris.data, iris.target)
+    assert_greater(model.score(iris.data, iris.target), score)
+    assert model.n_iter_ <= 50
+    # the relevances stay fixed without a phase that optimizes them
+    model = GmlvqModel(phases=['prototypes'], random_state=0)
+    model.fit(iris.data, iris.target)
+    assert_allclose(model.omega_, np.eye(4) / 2)
+    model = GrlvqModel(max_time=1e-9, random_state=0)
+    model.fit(iris.data, iris.target)
+    assert model.n_iter_ <= 1
+    assert_raise_message(ValueError, "phases must contain",
+                         GmlvqModel(phases=['omega']).fit,
+                         iris.data, iris.target)
+    assert_raise_message(ValueError, "max_time must be a positive number",
+                         GmlvqModel(max_time=0).fit,
+                         iris.data, iris.target)
+
+
+class _NoNoise(object):
+    """Random state without the noise the models add to their gradients."""
+
+    def rand(self, *shape):
+        return np.zeros(shape)
+
+
+def _check_gradient(fun, jac, variables, n_data, nb_prototype_values,
+                    relevance_factor=1):
+    """Compare jac with central differences of fun at variables.
+
+    Without noise the models return half the gradient of the mean cost for
+    the prototypes and relevance_factor times it for the relevances.
+    """
+    eps = 1e-6
+    numeric = np.array([fun(variables + eps * e) - fun(variables - eps * e)
+                        for e in np.eye(variables.size)]) / (2 * eps * n_data)
+    numeric[:nb_prototype_values] *= 0.5
+    numeric[nb_prototype_values:] *= relevance_factor
+    assert_allclose(jac(variables), numeric, rtol=1e-4, atol=1e-9)
+
+
+def test_glvq_gradients():
+    x, y = iris.data, iris.target
+    rng = check_random_state(0)
+    models = [
+        (GlvqModel(max_iter=1), []),
+        # GrlvqModel sets negative relevances to a small positive value
+        (GrlvqModel(max_iter=1), [rng.rand(4) + 0.5]),
+        (GmlvqModel(dim=2, max_iter=1), [rng.randn(2, 4)]),
+        # the prototype gradient of GrmlvqModel is exact for unit relevances
+        # and an orthonormal omega only
+        (GrmlvqModel(max_iter=1), [np.eye(4), np.ones(4)]),
+        (LgmlvqModel(dim=[1, 2, 4], max_iter=1),
+         [rng.randn(1, 4), rng.randn(2, 4), rng.randn(4, 4)]),
+    ]
+    for model, relevances in models:
+        model.fit(x, y)
+        prototypes = model.w_ + rng.randn(*model.w_.shape) * 0.1
+        variables = np.concatenate([prototypes.ravel()] +
+                                   [r.ravel() for r in relevances])
+        label_equals_prototype = y[np.newaxis].T == model.c_w_
+        if isinstance(model, LgmlvqModel):
+            fun, jac = model._f, model._g
+        else:
+            fun, jac = model._optfun, model._optgrad
+        lr = {'lr_relevances': 1, 'lr_prototypes': 1} if relevances else {}
+        _check_gradient(
+            lambda v: fun(v, x, label_equals_prototype),
+            lambda v: jac(v, x, label_equals_prototype, _NoNoise(), **lr),
+            variables, x.shape[0], prototypes.size,
+            relevance_factor=2 if isinstance(model, GrlvqModel) else 1)
@@ -1,6 +1,7 @@
 import numpy as np
 
-from sklearn.utils.testing import assert_greater, assert_raise_message
+from sklearn.utils.testing import assert_greater, assert_raise_message, \
+    assert_allclose
 
 from sklearn import datasets
 from sklearn.utils import check_random_state
@@ -9,6 +10,7 @@ from sklearn.utils.estimator_checks import check_estimator
 from .. import LmrslvqModel
 from .. import MrslvqModel
 from .. import RslvqModel
+from .test_glvq import _NoNoise, _check_gradient
 
 # also load the iris dataset
 iris = datasets.load_iris()
@@ -134,3 +136,68 @@ def test_lmrslvq_iris():
 
     model = LmrslvqModel(regularization=0.1)
     model.fit(iris.data, iris.target)
+
+
+def test_lmrslvq_local_ranks():
+    model = LmrslvqModel(dim=[1, 2, 4], random_state=0)
+    model.fit(iris.data, iris.target)
+    assert [omega.shape for omega in model.omegas_] == \
+        [(1, 4), (2, 4), (4, 4)]
+    assert_greater(model.score(iris.data, iris.target), score)
+    costs = model._costs(iris.data, model.w_)
+    for j, omega in enumerate(model.omegas_):
+        d = iris.data - model.w_[j]
+        assert_allclose(
+            costs[:, j], -(d.dot(omega.T) ** 2).sum(1) / (2 * model.sigma))
+
+
+def test_rslvq_predict_proba():
+    for model in [RslvqModel(random_state=0), MrslvqModel(random_state=0),
+                  LmrslvqModel(random_state=0)]:
+        model.fit(iris.data, iris.target)
+        proba = model.predict_proba(iris.data)
+        assert proba.shape == (iris.data.shape[0], 3)
+        assert_allclose(proba.sum(1), 1)
+        assert_allclose(np.exp(model.predict_log_proba(iris.data)), proba)
+        assert_allclose(proba[0, 0],
+                        sum(model._p(j, iris.data[0])
+                            for j in range(model.w_.shape[0])
+                            if model.c_w_[j] == model.classes_[0]))
+        model.chunk_size = 7
+        assert_allclose(model.predict_proba(iris.data), proba)
+        assert_greater(np.mean(model.classes_[proba.argmax(1)] ==
+                               iris.target), score)
+
+
+def test_rslvq_gradients():
+    x, y = iris.data, iris.target
+    rng = check_random_state(0)
+    model = RslvqModel(max_iter=1).fit(x, y)
+    prototypes = model.w_ + rng.randn(*model.w_.shape) * 0.1
+    _check_gradient(lambda v: model._optfun(v, x, y),
+                    lambda v: model._optgrad(v, x, y, _NoNoise()),
+                    prototypes.ravel(), x.shape[0], prototypes.size)
+
+
+def test_mrslvq_gradients():
+    x, y = iris.data, iris.target
+    rng = check_random_state(0)
+    models = [
+        # the prototype gradient of MrslvqModel is exact for an orthonormal
+        # omega only
+        (MrslvqModel(max_iter=1), [np.eye(4)]),
+        # small matrices, for which the posteriors do not saturate
+        (LmrslvqModel(dim=[1, 2, 4], max_iter=1),
+         [rng.randn(1, 4) * 0.3, rng.randn(2, 4) * 0.3,
+          rng.randn(4, 4) * 0.3]),
+    ]
+    for model, relevances in models:
+        model.fit(x, y)
+        prototypes = model.w_ + rng.randn(*model.w_.shape) * 0.1
+        variables = np.concatenate([prototypes.ravel()] +
+                                   [r.ravel() for r in relevances])
+        _check_gradient(
+            lambda v: model._optfun(v, x, y),
+            lambda v: model._optgrad(v, x, y, _NoNoise(), lr_relevances=1,
+                                     lr_prototypes=1),
+            variables, x.shape[0], prototypes.size)
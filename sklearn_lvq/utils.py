@@ -1,6 +1,5 @@
 from operator import itemgetter
 
-import matplotlib.pyplot as plt
 from sklearn.utils import validation
 
 
@@ -22,6 +21,7 @@ def plot2d(model, x, y, figure, title=""):
     title : str, optional
         the title to use, optional
     """
+    import matplotlib.pyplot as plt
     x, y = validation.check_X_y(x, y)
     dim = 2
     f = plt.figure(figure)
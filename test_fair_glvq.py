@@ -0,0 +1,123 @@
+import numpy as np
+
+from fair_glvq import FairGlvqModel, PENALTIES, group_partition, \
+    mean_difference
+from sklearn.utils.testing import assert_greater, assert_raise_message, \
+    assert_allclose
+
+from sklearn import datasets
+from sklearn.utils import check_random_state
+from sklearn_lvq.glvq import _squared_euclidean
+
+# also load the iris dataset
+
+iris = datasets.load_iris()
+rng = check_random_state(42)
+perm = rng.permutation(iris.target.size)
+iris.data = iris.data[perm]
+iris.target = iris.target[perm]
+
+
+def test_fair_glvq_one_group_batches():
+    # mini-batches of two samples often hold only one group, which leaves
+    # the group means of the penalty undefined
+    protected = iris.data[:, 0] > 5.8
+    for penalty in ['quadratic', 'abs', 'normalized']:
+        model = FairGlvqModel(penalty=penalty, alpha=0.1, solver='sgd',
+                              batch_size=2, max_iter=5,
+                              learning_rate_init=0.2, random_state=0)
+        model.fit_fair(iris.data, iris.target, protected)
+        assert np.isfinite(model.w_).all()
+        assert_greater(model.score(iris.data, iris.target), 0.85)
+
+
+def test_fair_glvq_partial_fit_one_group():
+    protected = iris.data[:, 0] > 5.8
+    mixed = iris.target > 0
+    model = FairGlvqModel(alpha=1, solver='adam', batch_size=16,
+                          random_state=0)
+    model.partial_fit(iris.data[protected], iris.target[protected],
+                      protected[protected])
+    assert np.isfinite(model.w_).all()
+    for epoch in range(10):
+        model.partial_fit(iris.data[mixed], iris.target[mixed],
+                          protected[mixed])
+    assert np.isfinite(model.w_).all()
+    assert_greater(model.score(iris.data[mixed], iris.target[mixed]), 0.85)
+    # the penalty weighs the groups by their sizes over all batches
+    assert_allclose(model._group_counts,
+                    [10 * (~protected[mixed]).sum(),
+                     protected.sum() + 10 * protected[mixed].sum()])
+
+
+def test_fair_glvq_options():
+    protected = iris.data[:, 0] > 5.8
+    model = FairGlvqModel(alpha=1, random_state=0)
+    model.fit_fair(iris.data, iris.target, protected)
+    assert_greater(model.score(iris.data, iris.target), 0.85)
+    # chunk_size only splits predict, fit_fair sees all samples at once
+    chunked = FairGlvqModel(alpha=1, random_state=0, chunk_size=7, n_jobs=2)
+    chunked.fit_fair(iris.data, iris.target, protected)
+    assert_allclose(chunked.w_, model.w_)
+    assert_allclose(chunked.decision_function(iris.data),
+                    model.decision_function(iris.data))
+
+    model = FairGlvqModel(alpha=1, dtype=np.float32, n_init=2,
+                          random_state=0)
+    model.fit_fair(iris.data, iris.target, protected)
+    assert model.w_.dtype == np.float32
+    assert_greater(model.score(iris.data, iris.target), 0.85)
+
+    assert_raise_message(ValueError, 'use fit_fair', FairGlvqModel().fit,
+                         iris.data, iris.target)
+    assert_raise_message(ValueError, 'penalty must be one of',
+                         FairGlvqModel(penalty='hinge').fit_fair, iris.data,
+                         iris.target, protected)
+
+
+class _NoNoise(object):
+    """Random state for _optgrad without the noise on the gradient, which
+    then is exactly half of the derivative of the cost."""
+
+    def rand(self, *shape):
+        return np.zeros(shape)
+
+
+def test_fair_glvq_gradient():
+    binary = iris.target == 2
+    protected = iris.data[:, 0] > 5.8
+    order, protected_labels = group_partition(protected, binary.size)
+    x, y = iris.data[order], binary[order]
+    for penalty in sorted(PENALTIES):
+        for alpha in [0, 1, 10]:
+            model = FairGlvqModel(penalty=penalty, alpha=alpha, max_iter=3,
+                                  random_state=0)
+            model.fit_fair(iris.data, binary, protected)
+            args = (x, y[np.newaxis].T == model.c_w_, protected_labels,
+                    model._nr_protected(protected_labels), PENALTIES[penalty])
+            variables = model.w_.ravel()
+            gradient = model._optgrad(variables, args[0], args[1], _NoNoise(),
+                                      *args[2:])
+            eps = 1e-6
+            numeric = np.array([
+                model._optfun(variables + eps * e, *args) -
+                model._optfun(variables - eps * e, *args)
+                for e in np.eye(variables.size)]) / (2 * eps)
+            # without the penalty the cost is the glvq sum, not the mean
+            if alpha == 0:
+                numeric /= y.size
+            assert_allclose(2 * gradient, numeric, rtol=1e-5, atol=1e-9)
+
+
+def test_fair_glvq_alpha():
+    binary = iris.target == 2
+    protected = iris.data[:, 0] > 5.8
+    differences = []
+    for alpha in [0, 1, 10]:
+        model = FairGlvqModel(alpha=alpha, random_state=0)
+        model.fit_fair(iris.data, binary, protected)
+        differences.append(abs(mean_difference(
+            protected, protected.sum(),
+            _squared_euclidean(iris.data, model.w_), model.beta)))
+    assert differences[0] > differences[1] > differences[2]
+    assert differences[2] < 0.01